@@ -0,0 +1,257 @@
+import argparse
+import datetime
+import gc
+import json
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+import numba
+import numpy as np
+import lambdaforge.computation as comp
+import lambdaforge.production as pr
+import lambdaforge.reduction as rd
+from lambdaforge.cache import derived
+from lambdaforge.forge import Forge, Geometric
+from lambdaforge.lambda_term import Lambda
+
+# benchmark suite of lambdaforge. Every benchmark runs on terms of 2^k nodes, sampled with fixed seeds, and
+# measures the best time over a few repetitions and the peak memory of the first one. The results are written
+# to a JSON file, with a scaling exponent fitted on the times and on the memory of each benchmark, and two
+# result files can be compared with --compare.
+#
+#   python benchmarks/run.py --min 10 --max 24 --output results.json
+#   python benchmarks/run.py --compare before.json after.json
+
+SEED = 20240101
+
+# the term of exactly n nodes used by the benchmarks of size n
+def term(n:int) -> Lambda:
+    f = Forge(n, n, exact_size=True, seed=SEED + n)
+    f.de_bruijn_sampler = Geometric(0.3)
+    return f.craft()
+
+# a copy of l sharing its arrays, but not the arrays cached for l
+def fresh(l:Lambda) -> Lambda:
+    return Lambda(l.size, l.abstraction_kernel, l.application_kernel, l.variable_kernel, l.de_bruijn_indices)
+
+# Forge.craft with retries: sizes between n and 2n. The number of rejected attempts is reported
+def craft_setup(n):
+    f = Forge(n, 2 * n, seed=SEED + n)
+    f.attempts = 0
+    nodes_may_fail = f.nodes_may_fail
+    def counted():
+        f.attempts += 1
+        return nodes_may_fail()
+    f.nodes_may_fail = counted
+    return f
+def craft_run(f):
+    f.attempts = 0
+    l = f.craft()
+    return {'nodes': int(l.size), 'retries': f.attempts - 1}
+
+# Forge.craft with exact_size: the size is drawn first, here exactly n
+def craft_exact_setup(n):
+    return Forge(n, n, exact_size=True, seed=SEED + n)
+def craft_exact_run(f):
+    return {'nodes': int(f.craft().size)}
+
+def compute_kernel_setup(n):
+    l = term(n)
+    return l.node_kind()
+def compute_kernel_run(kind):
+    comp.compute_kernel(kind, comp.index_dtype(kind.size))
+
+def forward_integral_setup(n):
+    l = term(n)
+    l.node_kind()
+    return l, np.ones(l.size, dtype=l.application_kernel.dtype)
+def forward_integral_run(state):
+    l, ones = state
+    l.forward_integral(ones)
+def backward_integral_run(state):
+    l, ones = state
+    l.backward_integral(ones)
+
+# bindings on a term whose cached arrays are dropped before each run
+def bindings_setup(n):
+    return term(n)
+def bindings_run(l):
+    fresh(l).bindings()
+
+# one step of beta reduction at the leftmost redex
+def reduce_at_setup(n):
+    l = term(n)
+    redex = np.flatnonzero(l.redex())
+    return l, int(redex[0]) if redex.size > 0 else None
+def reduce_at_run(state):
+    l, index = state
+    if index is not None:
+        rd.reduce_at(fresh(l), index)
+
+# the normal order loop, with a budget of 100 steps and 4 times the size of the term
+def normalize_setup(n):
+    return term(n)
+def normalize_run(l):
+    _, steps, status = rd.normalize(l, 'normal', max_steps=100, max_size=4 * l.size)
+    return {'steps': int(steps), 'status': int(status)}
+
+def printer_setup(n):
+    return term(n)
+def polish_de_bruijn_run(l):
+    pr.polish_de_bruijn(fresh(l))
+def parenthesis_de_bruijn_run(l):
+    pr.parenthesis_de_bruijn(fresh(l))
+
+# the named printers need one name per abstraction
+def named_setup(n):
+    l = term(n)
+    names = np.char.mod('x%d', np.arange(l.size))
+    return l, names, np.char.mod('f%d', np.arange(l.size))
+def polish_named_run(state):
+    l, names, free = state
+    pr.polish_named(fresh(l), names, free)
+def parenthesis_named_run(state):
+    l, names, free = state
+    pr.parenthesis_named(fresh(l), names, free)
+
+def layout_setup(n):
+    return term(n)
+def layout_run(l):
+    fresh(l).layout()
+
+# name -> (setup, run, largest exponent). Benchmarks whose cost or memory explodes are stopped earlier
+BENCHMARKS = {
+    'craft': (craft_setup, craft_run, 18),
+    'craft_exact': (craft_exact_setup, craft_exact_run, 24),
+    'compute_kernel': (compute_kernel_setup, compute_kernel_run, 24),
+    'forward_integral': (forward_integral_setup, forward_integral_run, 24),
+    'backward_integral': (forward_integral_setup, backward_integral_run, 24),
+    'bindings': (bindings_setup, bindings_run, 24),
+    'reduce_at': (reduce_at_setup, reduce_at_run, 24),
+    'normalize': (normalize_setup, normalize_run, 20),
+    'polish_de_bruijn': (printer_setup, polish_de_bruijn_run, 22),
+    'parenthesis_de_bruijn': (printer_setup, parenthesis_de_bruijn_run, 20),
+    'polish_named': (named_setup, polish_named_run, 20),
+    'parenthesis_named': (named_setup, parenthesis_named_run, 20),
+    'layout': (layout_setup, layout_run, 24),
+}
+
+# the peak resident memory of the process is reset through /proc on Linux. Elsewhere, only the memory
+# allocated through Python (tracemalloc) is measured, which misses the arrays allocated by numba
+def reset_peak_rss():
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+def read_status(field):
+    with open('/proc/self/status') as f:
+        for line in f:
+            if line.startswith(field):
+                return int(line.split()[1]) * 1024
+    return None
+
+# run a benchmark once, returns the time, the peak memory allocated through Python, the peak resident memory
+# above the memory at the start of the run (None if it cannot be measured) and the extra information it reports
+def measure(run, state):
+    gc.collect()
+    rss = reset_peak_rss()
+    start_rss = read_status('VmRSS:') if rss else None
+    tracemalloc.start()
+    t0 = time.perf_counter()
+    extra = run(state)
+    seconds = time.perf_counter() - t0
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    peak_rss = read_status('VmHWM:') - start_rss if rss else None
+    return seconds, peak, peak_rss, extra or {}
+
+# the best time over repeat runs, and the memory of the first run (tracemalloc slows the run it traces)
+def benchmark(name, n, repeat):
+    setup, run, _ = BENCHMARKS[name]
+    state = setup(n)
+    _, peak, peak_rss, extra = measure(run, state)
+    times = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        run(state)
+        times.append(time.perf_counter() - t0)
+    derived.clear()
+    return {'benchmark': name, 'exponent': int(np.log2(n)), 'size': n, 'seconds': min(times),
+            'python_peak_bytes': peak, 'rss_peak_bytes': peak_rss, **extra}
+
+# slope of log(value) against log(size), on the sizes where the value is large enough to be measured reliably
+def fit_exponent(sizes, values, threshold):
+    sizes, values = np.asarray(sizes, dtype=float), np.asarray(values, dtype=float)
+    keep = values > threshold
+    if np.count_nonzero(keep) < 2: return None
+    return float(np.polyfit(np.log(sizes[keep]), np.log(values[keep]), 1)[0])
+
+def exponents(results):
+    fitted = {}
+    for name in dict.fromkeys(r['benchmark'] for r in results):
+        rows = [r for r in results if r['benchmark'] == name and 'error' not in r]
+        sizes = [r['size'] for r in rows]
+        memory = [r['rss_peak_bytes'] if r['rss_peak_bytes'] is not None else r['python_peak_bytes'] for r in rows]
+        fitted[name] = {'time': fit_exponent(sizes, [r['seconds'] for r in rows], 1e-4),
+                        'memory': fit_exponent(sizes, memory, 2**20)}
+    return fitted
+
+def environment():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {'date': datetime.datetime.now().isoformat(), 'commit': commit, 'python': platform.python_version(),
+            'numpy': np.__version__, 'numba': numba.__version__, 'machine': platform.machine(),
+            'processor': platform.processor(), 'seed': SEED}
+
+# print the ratio of the times of two result files, benchmark by benchmark
+def compare(before, after):
+    with open(before) as f: old = json.load(f)
+    with open(after) as f: new = json.load(f)
+    times = {(r['benchmark'], r['size']): r['seconds'] for r in old['results'] if 'error' not in r}
+    print(f"{'benchmark':24}{'size':>10}{'before':>12}{'after':>12}{'ratio':>8}")
+    for r in new['results']:
+        key = (r['benchmark'], r['size'])
+        if key in times and 'error' not in r:
+            print(f"{key[0]:24}{key[1]:>10}{times[key]:>12.5f}{r['seconds']:>12.5f}{r['seconds'] / times[key]:>8.2f}")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='lambdaforge benchmarks')
+    parser.add_argument('--min', type=int, default=10, help='smallest size, as a power of 2')
+    parser.add_argument('--max', type=int, default=24, help='largest size, as a power of 2')
+    parser.add_argument('--step', type=int, default=2, help='step between the exponents of the sizes')
+    parser.add_argument('--repeat', type=int, default=3, help='number of timed runs, the best one being kept')
+    parser.add_argument('--only', default=None, help='comma separated names of the benchmarks to run')
+    parser.add_argument('--output', default='benchmark_results.json')
+    parser.add_argument('--compare', nargs=2, metavar=('BEFORE', 'AFTER'), help='compare two result files and exit')
+    args = parser.parse_args(argv)
+    if args.compare:
+        compare(*args.compare)
+        return
+    names = args.only.split(',') if args.only else list(BENCHMARKS)
+    results = []
+    for name in names:
+        setup, run, largest = BENCHMARKS[name]
+        # compile the kernels before timing
+        run(setup(2**6))
+        for k in range(args.min, min(args.max, largest) + 1, args.step):
+            try:
+                r = benchmark(name, 2**k, args.repeat)
+            except Exception as e:
+                r = {'benchmark': name, 'exponent': k, 'size': 2**k, 'error': repr(e)}
+            results.append(r)
+            print(json.dumps(r), file=sys.stderr)
+    report = {'environment': environment(), 'results': results, 'scaling': exponents(results)}
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=1)
+    for name, fitted in report['scaling'].items():
+        print(f"{name:24} time ~ n^{fitted['time']}  memory ~ n^{fitted['memory']}")
+
+if __name__ == '__main__':
+    main()
@@ -1,3 +1,6 @@
 #import sys
-from lambdaforge.forge import Forge,CGBW_tree,Geometric
-from lambdaforge.lambda_term import Lambda
\ No newline at end of file
+from lambdaforge.forge import Forge,CGBW_tree,Geometric,TruncatedGeometric,UniformBinder
+from lambdaforge.lambda_term import Lambda
+from lambdaforge.batch import LambdaBatch
+from lambdaforge.dag import LambdaDAG
+from lambdaforge.startup import warmup
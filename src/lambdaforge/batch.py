@@ -0,0 +1,125 @@
+import numpy as np
+import lambdaforge.computation as comp
+from dataclasses import dataclass
+from .lambda_term import Lambda
+
+# a packed collection of lambda terms. The four arrays of every term are stored one after the other
+# (CSR style), the term j occupying the nodes offsets[j]:offsets[j+1]. Kernels are relative to the first
+# node of their term, so that each term can be read as a Lambda without copying anything
+@dataclass
+class LambdaBatch:
+    offsets:np.array(np.int64)            # the index of the first node of each term, followed by the total number of nodes
+    abstraction_kernel:np.array(np.int64)
+    application_kernel:np.array(np.int64)
+    variable_kernel:np.array(np.int64)
+    de_bruijn_indices:np.array(np.int64)
+
+    # creates a batch from the concatenated kinds (variable:-1,abstraction:0,application:1) and de Bruijn indices of its terms.
+    # as in Lambda.from_kind, the kernels and the indices are stored in the narrowest integer type holding their values
+    # with parallel=True, the kernels of the terms are computed by several numba threads
+    @staticmethod
+    def from_kind(kind:np.array(np.int64),de_bruijn_indices:np.array(np.int64),offsets:np.array(np.int64),parallel=False):
+        offsets = np.asarray(offsets, dtype=np.int64)
+        kind = np.asarray(kind).astype(np.int8, copy=False)
+        largest = np.max(np.diff(offsets)) if offsets.size > 1 else 0
+        compute_kernel = comp.compute_kernel_segmented_parallel if parallel else comp.compute_kernel_segmented
+        abstraction_kernel,application_kernel,variable_kernel = compute_kernel(kind, offsets, comp.index_dtype(largest))
+        return LambdaBatch(offsets, abstraction_kernel, application_kernel, variable_kernel, comp.narrow_de_bruijn(np.asarray(de_bruijn_indices)))
+
+    # packs a list of Lambda into a batch
+    @staticmethod
+    def from_list(terms):
+        sizes = np.array([l.size for l in terms], dtype=np.int64)
+        offsets = np.concatenate(([0], np.cumsum(sizes))).astype(np.int64)
+        def concatenate(name):
+            if len(terms) == 0: return np.zeros(0, dtype=np.int32)
+            return np.concatenate([getattr(l, name) for l in terms])
+        return LambdaBatch(offsets,
+                           concatenate('abstraction_kernel'),
+                           concatenate('application_kernel'),
+                           concatenate('variable_kernel'),
+                           concatenate('de_bruijn_indices'))
+
+    # concatenates several batches into one
+    @staticmethod
+    def concatenate(batches):
+        if len(batches) == 0: return LambdaBatch.from_list([])
+        starts = np.cumsum([0] + [b.offsets[-1] for b in batches[:-1]])
+        offsets = np.concatenate([[0]] + [b.offsets[1:] + s for b, s in zip(batches, starts)]).astype(np.int64)
+        return LambdaBatch(offsets,
+                           np.concatenate([b.abstraction_kernel for b in batches]),
+                           np.concatenate([b.application_kernel for b in batches]),
+                           np.concatenate([b.variable_kernel for b in batches]),
+                           np.concatenate([b.de_bruijn_indices for b in batches]))
+
+    # unpacks the batch into a list of Lambda sharing its memory
+    def to_list(self):
+        return [self[i] for i in range(len(self))]
+
+    # number of terms in the batch
+    def __len__(self):
+        return self.offsets.size - 1
+
+    # the term at a given position as a Lambda viewing the batch arrays, or a sub-batch for a slice
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(len(self))
+            if step != 1: return LambdaBatch.from_list(self.to_list()[index])
+            stop = max(start, stop)
+            s, e = self.offsets[start], self.offsets[stop]
+            return LambdaBatch(self.offsets[start:stop+1] - s,
+                               self.abstraction_kernel[s:e],
+                               self.application_kernel[s:e],
+                               self.variable_kernel[s:e],
+                               self.de_bruijn_indices[s:e])
+        if index < 0: index += len(self)
+        if not 0 <= index < len(self): raise IndexError('term index out of range')
+        s, e = self.offsets[index], self.offsets[index+1]
+        return Lambda(e-s,
+                      self.abstraction_kernel[s:e],
+                      self.application_kernel[s:e],
+                      self.variable_kernel[s:e],
+                      self.de_bruijn_indices[s:e])
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    # the size of each term
+    def sizes(self):
+        return np.diff(self.offsets)
+
+    # kind of each node (variable:-1,abstraction:0,applicatoin:1), as in Lambda.node_kind
+    def node_kind(self):
+        dq = np.sign(np.diff(self.application_kernel.astype(np.int64), append=0)).astype(np.int8)
+        # the last node of each term is a variable
+        dq[self.offsets[1:] - 1] = -1
+        return dq
+
+    # for each node, sum v between the node and the root of its term, as in Lambda.forward_integral.
+    # with parallel=True, the terms are spread over the numba threads
+    def forward_integral(self, v:np.array(np.int64), parallel=False):
+        v = np.asarray(v)
+        integral = comp.forward_integral_segmented_parallel if parallel else comp.forward_integral_segmented
+        return integral(self.application_kernel, self.node_kind(), v.astype(np.result_type(v, self.application_kernel), copy=False), self.offsets)
+
+    # for each node, sum v on the subtree at the node, as in Lambda.backward_integral
+    def backward_integral(self, v:np.array(np.int64), parallel=False):
+        v = np.asarray(v)
+        integral = comp.backward_integral_segmented_parallel if parallel else comp.backward_integral_segmented
+        return integral(self.variable_kernel, self.node_kind(), v.astype(np.result_type(v, self.variable_kernel), copy=False), self.offsets)
+
+    # the height process of every term
+    def height(self, parallel=False):
+        return self.forward_integral(np.ones(self.offsets[-1], dtype=self.application_kernel.dtype), parallel)
+
+    # the number of abstractions above each node
+    def height_abs(self, parallel=False):
+        return self.forward_integral((self.node_kind() == 0).astype(self.application_kernel.dtype), parallel)
+
+    # statistics of every term, computed in a single pass: its height, the largest number of abstractions above
+    # a node, its number of free variables and its number of redexes
+    def statistics(self, parallel=False):
+        statistics = comp.statistics_segmented_parallel if parallel else comp.statistics_segmented
+        height, height_abs, free_variables, redexes = statistics(self.application_kernel, self.node_kind(), self.de_bruijn_indices, self.offsets)
+        return {'height': height, 'height_abs': height_abs, 'free_variables': free_variables, 'redexes': redexes}
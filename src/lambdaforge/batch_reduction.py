@@ -0,0 +1,87 @@
+import os
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+import lambdaforge.computation as comp
+from .batch import LambdaBatch
+from .reduction import normalize_arrays, NORMALIZED, STEP_LIMIT, SIZE_LIMIT, TIMEOUT
+
+# normalization of the terms of a batch over a pool of processes. The kinds, the De Bruijn indices and the offsets of
+# the terms are written once to a block of shared memory, which the workers read without copying, and each task
+# normalizes a range of terms and sends back its normal forms packed in flat arrays.
+# the kernels are not sent: the reduction only reads the kinds, and the kernels of the normal forms are computed
+# at once for the whole result
+
+ALIGNMENT = 64
+
+# copy arrays to a new block of shared memory. Returns the block and the layout of the arrays in it,
+# a list of (dtype, position, size)
+def share(arrays):
+    layout = []
+    position = 0
+    for a in arrays:
+        layout.append((a.dtype.str, position, a.size))
+        position += -(-a.nbytes // ALIGNMENT) * ALIGNMENT
+    block = shared_memory.SharedMemory(create=True, size=max(position, 1))
+    for a, (dtype, position, size) in zip(arrays, layout):
+        np.ndarray(size, dtype=dtype, buffer=block.buf, offset=position)[:] = a
+    return block, layout
+
+# open a block of shared memory created by share in another process. The block belongs to its creator: it is not
+# tracked again where the resource tracker allows it, and the workers of a pool share the tracker of their parent anyway
+def attach(name):
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        return shared_memory.SharedMemory(name=name)
+
+# normalize the terms start:stop of the batch shared in the block name. Returns the concatenated kinds and
+# De Bruijn indices of the results, their sizes, and the number of steps and the outcome for each term
+def normalize_range(name, layout, start, stop, leftmost, max_steps, max_size, timeout):
+    block = attach(name)
+    try:
+        offsets, kind, indices = [np.ndarray(size, dtype=dtype, buffer=block.buf, offset=position) for dtype, position, size in layout]
+        kinds, results = [], []
+        sizes = np.zeros(stop-start, dtype=np.int64)
+        steps = np.zeros(stop-start, dtype=np.int64)
+        status = np.zeros(stop-start, dtype=np.int8)
+        for j in range(start, stop):
+            s, e = offsets[j], offsets[j+1]
+            k, i, steps[j-start], status[j-start], _ = normalize_arrays(kind[s:e], indices[s:e].astype(np.int64), leftmost, max_steps, max_size, timeout)
+            kinds.append(k)
+            results.append(i)
+            sizes[j-start] = k.size
+        # the views must be released before closing the block
+        del offsets, kind, indices
+    finally:
+        block.close()
+    if not kinds:
+        return np.zeros(0, dtype=np.int8), np.zeros(0, dtype=np.int8), sizes, steps, status
+    return np.concatenate(kinds), comp.narrow_de_bruijn(np.concatenate(results)), sizes, steps, status
+
+# normalize every term of a batch as reduction.normalize, over workers processes, by tasks of chunk_size terms.
+# max_steps, max_size and timeout (in seconds) bound the reduction of each term.
+# returns the batch of the reduced terms, the number of steps performed on each term, and the outcome of each
+# reduction (NORMALIZED, STEP_LIMIT, SIZE_LIMIT or TIMEOUT)
+def normalize_batch(b:LambdaBatch, strategy='normal', max_steps=1000, max_size=None, timeout=None, workers:int = None, chunk_size:int = 256):
+    if strategy not in ('normal', 'applicative'):
+        raise ValueError("strategy should be 'normal' or 'applicative'")
+    if max_size is None:
+        max_size = np.iinfo(np.int64).max
+    # compile the reduction before starting the workers, so that forked processes do not compile it again
+    comp.normalize_kernel(np.array([-1], dtype=np.int8), np.ones(1, dtype=np.int64), True, 0, max_size)
+    block, layout = share([b.offsets.astype(np.int64), b.node_kind(), b.de_bruijn_indices])
+    try:
+        ranges = [(j, min(j + chunk_size, len(b))) for j in range(0, len(b), chunk_size)]
+        with ProcessPoolExecutor(max_workers=workers or os.cpu_count()) as pool:
+            futures = [pool.submit(normalize_range, block.name, layout, start, stop, strategy == 'normal', max_steps, max_size, timeout)
+                       for start, stop in ranges]
+            parts = [f.result() for f in futures]
+    finally:
+        block.close()
+        block.unlink()
+    if not parts:
+        return b, np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int8)
+    kind, indices, sizes, steps, status = (np.concatenate(a) for a in zip(*parts))
+    offsets = np.concatenate(([0], np.cumsum(sizes))).astype(np.int64)
+    return LambdaBatch.from_kind(kind, indices, offsets), steps, status
@@ -0,0 +1,101 @@
+import threading
+import weakref
+import functools
+from collections import OrderedDict
+
+# memoization of the arrays derived from a term (kinds, heights, bindings...). Terms are immutable (frozen
+# dataclasses): each array is computed on first use and shared by the following calls. The arrays are stored in
+# the term itself, so that they live and die with it.
+# an optional budget bounds the number of bytes held by the cache, the least recently used arrays being evicted first.
+# the terms are only tracked while a budget is set, so that creating a term costs nothing to the cache otherwise
+SLOT = '_derived'
+
+class DerivedCache:
+    def __init__(self, budget=None):
+        self.budget = budget   # maximum number of bytes held, None for no limit
+        self.nbytes = 0
+        self.generation = 0    # increased by clear, the arrays stored with an older generation are ignored
+        self.entries = OrderedDict() # (id of the term, name) -> number of bytes, from the least to the most recently used
+        self.owners = {}             # id of the term -> (weak reference to the term, names of its counted arrays)
+        self.lock = threading.Lock()
+
+    # the arrays of the term, as a dict name -> array
+    def arrays(self, term):
+        arrays = term.__dict__.get(SLOT)
+        if arrays is None or arrays['generation'] != self.generation:
+            arrays = {'generation': self.generation}
+            object.__setattr__(term, SLOT, arrays)
+        return arrays
+
+    # the array called name of the term, computed by compute() if it is not in the cache
+    def get(self, term, name, compute):
+        value = self.arrays(term).get(name)
+        if value is not None:
+            if self.budget is not None:
+                with self.lock:
+                    if (id(term), name) in self.entries:
+                        self.entries.move_to_end((id(term), name))
+            return value
+        value = compute()
+        self.put(term, name, value)
+        return value
+
+    # store the array called name of the term. The cached array is shared, it is protected from modifications:
+    # arrays that others can still modify should be copied before
+    def put(self, term, name, value):
+        value.flags.writeable = False
+        self.arrays(term)[name] = value
+        if self.budget is None: return
+        key = (id(term), name)
+        with self.lock:
+            if key in self.entries:
+                self.nbytes -= self.entries.pop(key)
+            elif id(term) not in self.owners:
+                # forget the arrays of the term when it is garbage collected
+                self.owners[id(term)] = (weakref.ref(term, functools.partial(self.discard, id(term))), set())
+            self.entries[key] = value.nbytes
+            self.owners[id(term)][1].add(name)
+            self.nbytes += value.nbytes
+            self.evict()
+
+    # remove the least recently used arrays until the cache fits in its budget
+    def evict(self):
+        while self.budget is not None and self.nbytes > self.budget and self.entries:
+            (owner, name), nbytes = self.entries.popitem(last=False)
+            self.nbytes -= nbytes
+            ref, names = self.owners[owner]
+            names.discard(name)
+            term = ref()
+            if term is not None:
+                term.__dict__.get(SLOT, {}).pop(name, None)
+
+    # stop tracking a term, called when it is garbage collected
+    def discard(self, owner, ref=None):
+        with self.lock:
+            _, names = self.owners.pop(owner, (None, ()))
+            for name in names:
+                self.nbytes -= self.entries.pop((owner, name))
+
+    def clear(self):
+        with self.lock:
+            self.generation += 1
+            self.entries.clear()
+            self.owners.clear()
+            self.nbytes = 0
+
+# the cache shared by all the terms
+derived = DerivedCache()
+
+# set the maximum number of bytes held by the cache (None for no limit). Only the arrays computed after the budget
+# is set are counted
+def set_budget(budget):
+    with derived.lock:
+        derived.budget = budget
+        derived.evict()
+
+# decorator memoizing a method of a term without arguments
+def cached(method):
+    @functools.wraps(method)
+    def wrapper(self):
+        return derived.get(self, method.__name__, lambda: method(self))
+    return wrapper
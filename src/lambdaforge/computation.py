@@ -1,12 +1,55 @@
 import numpy as np
 import numba as nb
+import math
+import types
 
-@nb.njit
-def compute_kernel(kind:np.array(np.int64)):
+# every kernel is compiled with cache=True: the machine code is written next to this file (or in NUMBA_CACHE_DIR),
+# and fresh processes load it instead of compiling again. See warmup to compile them ahead of time
+
+# the kernel compiled with parallel=True, its prange loops being spread over the numba threads. The function is
+# copied under its own name, so that the cache keeps the sequential and the parallel versions apart
+def parallel_version(kernel):
+    f = kernel.py_func
+    copy = types.FunctionType(f.__code__, f.__globals__, f.__name__ + '_parallel', f.__defaults__, f.__closure__)
+    copy.__qualname__ = f.__qualname__ + '_parallel'
+    return nb.njit(parallel=True, cache=True)(copy)
+
+# the bounds of the integer dtypes, read once: np.iinfo builds a new object on every call
+INT32_MAX = int(np.iinfo(np.int32).max)
+DE_BRUIJN_DTYPES = [(dtype, int(np.iinfo(dtype).min), int(np.iinfo(dtype).max)) for dtype in (np.int8, np.int16, np.int32)]
+
+# the narrowest dtype for the kernels of a term of a given size, whose values are between -1 and size-1
+def index_dtype(size:int):
+    return np.int32 if size <= INT32_MAX else np.int64
+
+# the narrowest dtype holding the De Bruijn indices between minimum and maximum
+def de_bruijn_dtype(minimum:int,maximum:int):
+    for dtype, low, high in DE_BRUIJN_DTYPES:
+        if low <= minimum and maximum <= high: return dtype
+    return np.int64
+
+# the minimum and the maximum of a non empty array, in one pass
+@nb.njit(nogil=True, cache=True)
+def min_max(a):
+    low = a[0]
+    high = a[0]
+    for i in range(1, a.size):
+        if a[i] < low: low = a[i]
+        elif a[i] > high: high = a[i]
+    return low, high
+
+# the De Bruijn indices in the narrowest dtype holding them. Indices already stored on one byte are kept as they are
+def narrow_de_bruijn(indices:np.array(np.int64)):
+    if indices.size == 0: return indices.astype(np.int8)
+    if indices.dtype == np.int8: return indices
+    return indices.astype(de_bruijn_dtype(*min_max(indices)), copy=False)
+
+@nb.njit(nogil=True, cache=True)
+def fill_kernel(kind, abs_kernel, app_kernel, var_kernel):
     n = kind.size
-    abs_kernel = -np.ones(n, dtype=np.int64)
-    app_kernel = -np.ones(n, dtype=np.int64)
-    var_kernel = -np.ones(n, dtype=np.int64)
+    if n == 0: return
+    abs_kernel[0] = -1
+    app_kernel[0] = -1
     for i in range(1,n):
         if kind[i-1] == 0:
             app_kernel[i] = app_kernel[i-1]
@@ -24,11 +67,35 @@ def compute_kernel(kind:np.array(np.int64)):
             var_kernel[i] = var_kernel[var_kernel[i+1]+1]
         else:
             var_kernel[i] = i
+# the arrays are allocated outside of numba: a compiled function taking a dtype as argument costs several
+# microseconds per call to dispatch, more than computing the kernels of a small term
+def compute_kernel(kind:np.array(np.int64),dtype=np.int64):
+    n = kind.size
+    abs_kernel = np.empty(n, dtype=dtype)
+    app_kernel = np.empty(n, dtype=dtype)
+    var_kernel = np.empty(n, dtype=dtype)
+    fill_kernel(kind, abs_kernel, app_kernel, var_kernel)
     return abs_kernel,app_kernel,var_kernel
-@nb.njit
-def forward_integral(application_kernel:np.array(np.int64),kind:np.array(np.int64),v:np.array(np.int64)):
+# kernels of a forest of terms stored one after the other in kind, the term j occupying offsets[j]:offsets[j+1]
+# the kernels of each term are relative to its first node, as if it had been computed alone.
+# the segmented functions go through the terms with prange: they run sequentially, and their _parallel versions
+# (compiled with parallel=True) spread the terms over the numba threads
+@nb.njit(nogil=True, cache=True)
+def compute_kernel_segmented(kind:np.array(np.int64),offsets:np.array(np.int64),dtype=np.int64):
+    n = kind.size
+    abs_kernel = -np.ones(n, dtype=dtype)
+    app_kernel = -np.ones(n, dtype=dtype)
+    var_kernel = -np.ones(n, dtype=dtype)
+    for j in nb.prange(offsets.size-1):
+        s = offsets[j]
+        e = offsets[j+1]
+        fill_kernel(kind[s:e], abs_kernel[s:e], app_kernel[s:e], var_kernel[s:e])
+    return abs_kernel,app_kernel,var_kernel
+compute_kernel_segmented_parallel = parallel_version(compute_kernel_segmented)
+
+@nb.njit(nogil=True, cache=True)
+def fill_forward_integral(application_kernel, kind, v, h):
     n = application_kernel.size
-    h = np.zeros(n,dtype= np.int64)
     for i in range(n-1):
         if kind[i] == 0:
             h[i+1] = h[i]+v[i]
@@ -36,11 +103,14 @@ def forward_integral(application_kernel:np.array(np.int64),kind:np.array(np.int6
             h[i+1] = h[i]+v[i]
         else:
             h[i+1] = h[application_kernel[i]]+v[i]
+@nb.njit(cache=True)
+def forward_integral(application_kernel:np.array(np.int64),kind:np.array(np.int64),v:np.array(np.int64)):
+    h = np.zeros(application_kernel.size,dtype= v.dtype)
+    fill_forward_integral(application_kernel, kind, v, h)
     return h
-@nb.njit
-def backward_integral(variable_kernel:np.array(np.int64),kind:np.array(np.int64),v:np.array(np.int64)):
+@nb.njit(nogil=True, cache=True)
+def fill_backward_integral(variable_kernel, kind, v, m):
     n = variable_kernel.size
-    m = np.zeros(n, dtype=np.int64)
     for i in range(n-1,-1,-1):
         if kind[i] == 0:
             m[i] = m[i+1] + v[i]
@@ -48,81 +118,724 @@ def backward_integral(variable_kernel:np.array(np.int64),kind:np.array(np.int64)
             m[i] = m[i+1]+ m[variable_kernel[i+1]+1] + v[i]
         else:
             m[i] = v[i]
+@nb.njit(cache=True)
+def backward_integral(variable_kernel:np.array(np.int64),kind:np.array(np.int64),v:np.array(np.int64)):
+    m = np.zeros(variable_kernel.size, dtype=v.dtype)
+    fill_backward_integral(variable_kernel, kind, v, m)
+    return m
+
+# forward and backward integrals of every term of a forest, with kernels relative to the first node of each term
+@nb.njit(nogil=True, cache=True)
+def forward_integral_segmented(application_kernel:np.array(np.int64),kind:np.array(np.int64),v:np.array(np.int64),offsets:np.array(np.int64)):
+    h = np.zeros(application_kernel.size, dtype=v.dtype)
+    for j in nb.prange(offsets.size-1):
+        s = offsets[j]
+        e = offsets[j+1]
+        fill_forward_integral(application_kernel[s:e], kind[s:e], v[s:e], h[s:e])
+    return h
+forward_integral_segmented_parallel = parallel_version(forward_integral_segmented)
+@nb.njit(nogil=True, cache=True)
+def backward_integral_segmented(variable_kernel:np.array(np.int64),kind:np.array(np.int64),v:np.array(np.int64),offsets:np.array(np.int64)):
+    m = np.zeros(variable_kernel.size, dtype=v.dtype)
+    for j in nb.prange(offsets.size-1):
+        s = offsets[j]
+        e = offsets[j+1]
+        fill_backward_integral(variable_kernel[s:e], kind[s:e], v[s:e], m[s:e])
     return m
+backward_integral_segmented_parallel = parallel_version(backward_integral_segmented)
+
+# statistics of every term of a forest, in one pass over its nodes: the height of the tree, the largest number of
+# abstractions above a node (the heights and height_abs of Lambda, integrated on the fly), the number of free
+# variables and the number of redexes
+@nb.njit(nogil=True, cache=True)
+def statistics_segmented(application_kernel:np.array(np.int64),kind:np.array(np.int64),indices:np.array(np.int64),offsets:np.array(np.int64)):
+    m = offsets.size-1
+    height = np.zeros(m, dtype=np.int64)
+    height_abs = np.zeros(m, dtype=np.int64)
+    free = np.zeros(m, dtype=np.int64)
+    redexes = np.zeros(m, dtype=np.int64)
+    for j in nb.prange(m):
+        s = offsets[j]
+        n = offsets[j+1]-s
+        h = np.zeros(n, dtype=np.int64)
+        habs = np.zeros(n, dtype=np.int64)
+        for i in range(n):
+            if i > 0:
+                if kind[s+i-1] == -1:
+                    h[i] = h[application_kernel[s+i-1]]+1
+                    habs[i] = habs[application_kernel[s+i-1]]
+                else:
+                    h[i] = h[i-1]+1
+                    habs[i] = habs[i-1]+(kind[s+i-1] == 0)
+            height[j] = max(height[j], h[i])
+            height_abs[j] = max(height_abs[j], habs[i])
+            if kind[s+i] == -1:
+                free[j] += indices[s+i] > habs[i]
+            elif kind[s+i] == 1 and kind[s+i+1] == 0:
+                redexes[j] += 1
+    return height, height_abs, free, redexes
+statistics_segmented_parallel = parallel_version(statistics_segmented)
+
+# level ancestor queries on the tree of abstractions: for each node, the abstraction at distance[i] above it
+# (1 for the closest one), or -1 if there are not enough abstractions above it. In depth first order, the abstractions
+# above the current node are kept in a stack indexed by habs: an abstraction only overwrites the abstractions of the
+# same level whose subterm is already completely visited
+@nb.njit(cache=True)
+def abstraction_ancestors(kind:np.array(np.int64),habs:np.array(np.int64),distance:np.array(np.int64),dtype=np.int64):
+    n = kind.size
+    path = np.zeros(n+1, dtype=dtype)
+    ancestors = -np.ones(n, dtype=dtype)
+    for i in range(n):
+        if 0 < distance[i] <= habs[i]:
+            ancestors[i] = path[habs[i]-distance[i]]
+        if kind[i] == 0:
+            path[habs[i]] = i
+    return ancestors
 
-def forward_substitute(kernel1,kernel2,variables):
+# number of substituted variables at or before each node
+@nb.njit(cache=True)
+def count_substituted(n, variables):
+    le = np.zeros(n, dtype=np.int64)
+    c = 0
+    for j in range(n):
+        if c < variables.size and variables[c] == j: c += 1
+        le[j] = c
+    return le
+
+# substitute kernel2 for each variable of kernel1 listed in variables, for kernels pointing to ancestors.
+# a node k of kernel1 moves to k + shift * (number of substituted variables before k)
+@nb.njit(cache=True)
+def forward_substitute(kernel1,kernel2,variables,dtype=np.int64):
     if variables.size == 0: return kernel1
-    size = kernel1.size + variables.size * (kernel2.size-1)
-    kernel = np.zeros(size,int)
     shift = kernel2.size-1
-    shifted_variables = variables + np.arange(variables.size) * shift
-    p = np.arange(kernel1.size)
-    p[p.size-1] = -1
-    kernel[0:variables[0]] = kernel1[0:variables[0]]
-    kernel[variables[0]:variables[0]+shift+1] = np.where(kernel2==-1,kernel1[variables[0]],kernel2+variables[0])
-    for i in range(variables.size-1):
-        p[variables[i]:p.size-1] += shift
-        kernel[shifted_variables[i]+shift+1:shifted_variables[i+1]] =  p[kernel1[variables[i]+1:variables[i+1]]]
-        kernel[shifted_variables[i+1]:shifted_variables[i+1]+shift+1] = np.where(kernel2==-1,p[kernel1[variables[i+1]]],kernel2+shifted_variables[i+1])
-    p[variables[variables.size-1]:p.size-1] += shift
-    kernel[shifted_variables[variables.size-1]+shift+1:] = p[kernel1[variables[variables.size-1]+1:]]
+    kernel = np.zeros(kernel1.size + variables.size * shift, dtype=dtype)
+    le = count_substituted(kernel1.size, variables)
+    c = 0
+    for j in range(kernel1.size):
+        k = kernel1[j]
+        parent = k + shift*le[k] if k >= 0 else -1
+        if c < variables.size and variables[c] == j:
+            start = j + shift*c
+            for t in range(kernel2.size):
+                kernel[start+t] = parent if kernel2[t] == -1 else kernel2[t]+start
+            c += 1
+        else:
+            kernel[j + shift*c] = parent
     return kernel
 
-def backward_substitute(kernel1,kernel2,variables):
+# substitute kernel2 for each variable of kernel1 listed in variables, for kernels pointing to descendants.
+# a node k of kernel1 pointing to a substituted variable now points to the last node of its copy of kernel2
+@nb.njit(cache=True)
+def backward_substitute(kernel1,kernel2,variables,dtype=np.int64):
     if variables.size == 0: return kernel1
-    size = kernel1.size + variables.size * (kernel2.size-1)
-    kernel = np.zeros(size,int)
     shift = kernel2.size-1
-    shifted_variables = variables + np.arange(variables.size) * shift
-    
-    p = np.arange(kernel1.size)+variables.size * shift
-    
-    kernel[shifted_variables[variables.size-1]+shift+1:] = p[kernel1[variables[variables.size-1]+1:]]
-    kernel[shifted_variables[variables.size-1]:shifted_variables[variables.size-1]+shift+1] = kernel2 + shifted_variables[variables.size-1]
-    for i in range(variables.size-2,-1,-1):
-        p[:variables[i+1]] -= shift
-        kernel[shifted_variables[i]+shift+1:shifted_variables[i+1]] =  p[kernel1[variables[i]+1:variables[i+1]]]
-        kernel[shifted_variables[i]:shifted_variables[i]+shift+1] = kernel2+shifted_variables[i]
-    p[:variables[0]] -= shift
-    kernel[0:variables[0]] = p[kernel1[0:variables[0]]]
+    kernel = np.zeros(kernel1.size + variables.size * shift, dtype=dtype)
+    le = count_substituted(kernel1.size, variables)
+    c = 0
+    for j in range(kernel1.size):
+        if c < variables.size and variables[c] == j:
+            start = j + shift*c
+            for t in range(kernel2.size):
+                kernel[start+t] = kernel2[t]+start
+            c += 1
+        else:
+            k = kernel1[j]
+            kernel[j + shift*c] = k + shift*le[k]
     return kernel
-def de_bruijn_substitute  (indices1,indices2,variables,habs1,free_var2):
+
+# substitute indices2 for each variable listed in variables, the free variables of indices2 being shifted
+# by the number of abstractions habs1 above the substituted variable
+@nb.njit(cache=True)
+def de_bruijn_substitute(indices1,indices2,variables,habs1,free_var2,dtype=np.int64):
     if variables.size == 0: return indices1
-    size = indices1.size + variables.size * (indices2.size-1)
-    indices = np.zeros(size,int)
     shift = indices2.size-1
-    shifted_variables = variables + np.arange(variables.size) * shift
-
-    indices[0:variables[0]] = indices1[0:variables[0]]
-    indices[variables[0]:variables[0]+shift+1] = indices2+free_var2 * (habs1[variables[0]])
-    for i in range(variables.size-1):
-        indices[shifted_variables[i]+shift+1:shifted_variables[i+1]] =  indices1[variables[i]+1:variables[i+1]]
-        indices[shifted_variables[i+1]:shifted_variables[i+1]+shift+1] = indices2+free_var2*(habs1[variables[i+1]])
-    indices[shifted_variables[variables.size-1]+shift+1:] = indices1[variables[variables.size-1]+1:]
+    indices = np.zeros(indices1.size + variables.size * shift, dtype=dtype)
+    c = 0
+    for j in range(indices1.size):
+        if c < variables.size and variables[c] == j:
+            start = j + shift*c
+            for t in range(indices2.size):
+                indices[start+t] = indices2[t]+free_var2[t]*habs1[j]
+            c += 1
+        else:
+            indices[j + shift*c] = indices1[j]
     return indices
+
+# the four substitutions of Lambda.substitute in a single pass. The De Bruijn indices of term 1 above the number of
+# abstractions habs1 over their node are decremented, as the abstraction binding the substituted variables disappears.
+# the result has kernels of type dtype and De Bruijn indices of type indices_dtype
+@nb.njit(cache=True)
+def substitute(abstraction_kernel1,application_kernel1,variable_kernel1,indices1,
+               abstraction_kernel2,application_kernel2,variable_kernel2,indices2,
+               variables,habs1,free_var2,dtype=np.int64,indices_dtype=np.int64):
+    n1 = indices1.size
+    m = indices2.size
+    shift = m-1
+    size = n1 + variables.size * shift
+    abstraction_kernel = np.zeros(size, dtype=dtype)
+    application_kernel = np.zeros(size, dtype=dtype)
+    variable_kernel = np.zeros(size, dtype=dtype)
+    indices = np.zeros(size, dtype=indices_dtype)
+    le = count_substituted(n1, variables)
+    c = 0
+    for j in range(n1):
+        a = abstraction_kernel1[j]
+        a = a + shift*le[a] if a >= 0 else -1
+        q = application_kernel1[j]
+        q = q + shift*le[q] if q >= 0 else -1
+        if c < variables.size and variables[c] == j:
+            start = j + shift*c
+            for t in range(m):
+                abstraction_kernel[start+t] = a if abstraction_kernel2[t] == -1 else abstraction_kernel2[t]+start
+                application_kernel[start+t] = q if application_kernel2[t] == -1 else application_kernel2[t]+start
+                variable_kernel[start+t] = variable_kernel2[t]+start
+                indices[start+t] = indices2[t]+free_var2[t]*habs1[j]
+            c += 1
+        else:
+            i = j + shift*c
+            v = variable_kernel1[j]
+            abstraction_kernel[i] = a
+            application_kernel[i] = q
+            variable_kernel[i] = v + shift*le[v]
+            indices[i] = indices1[j]-1 if indices1[j] > habs1[j] else indices1[j]
+    return abstraction_kernel,application_kernel,variable_kernel,indices
     
-def forward_insert(kernel1,kernel2,start,end):
+def forward_insert(kernel1,kernel2,start,end,dtype=np.int64):
+    kernel1, kernel2 = kernel1.astype(dtype, copy=False), kernel2.astype(dtype, copy=False)
     shift = kernel2.size-(end-start + 1)
     size = kernel1.size + shift
-    kernel = np.zeros(size,int)
+    kernel = np.zeros(size,dtype)
     kernel[0:start] = kernel1[0:start]
     kernel[start:start+kernel2.size] = np.where(kernel2==-1,kernel1[start],kernel2+start)
     kernel[start+kernel2.size:] = np.where(kernel1[end+1:]>end, kernel1[end+1:]+shift,kernel1[end+1:])
     return kernel
-def backward_insert(kernel1,kernel2,start,end):
+def backward_insert(kernel1,kernel2,start,end,dtype=np.int64):
+    kernel1, kernel2 = kernel1.astype(dtype, copy=False), kernel2.astype(dtype, copy=False)
     shift = kernel2.size-(end-start + 1)
     size = kernel1.size + shift
-    kernel = np.zeros(size,int)
+    kernel = np.zeros(size,dtype)
     kernel[0:start] = np.where(kernel1[0:start]>end, kernel1[0:start]+shift, np.where(kernel1[0:start]>=start,kernel2[0]+start, kernel1[0:start]))
     kernel[start:start+kernel2.size] = kernel2+start
     kernel[start+kernel2.size:] = kernel1[end+1:]+shift
     return kernel
-def de_bruijn_insert(indices1,indices2,start,end):
+def de_bruijn_insert(indices1,indices2,start,end,dtype=np.int64):
     shift = indices2.size-(end-start + 1)
     size = indices1.size + shift
-    indices = np.zeros(size,int)
+    indices = np.zeros(size,dtype)
     indices[0:start] = indices1[0:start]
     indices[start:start+indices2.size] = indices2
     indices[start+indices2.size:] = indices1[end+1:]
     return indices
-    
\ No newline at end of file
+    
+# weights of the sizes of a Bienaymé-Galton-Watson tree with reproduction law b*delta_0 + a*delta_1 + b*delta_2:
+# w[n] = P(S_n = -1)/n where S is the random walk of the node kinds (hitting time theorem).
+# P(S_n = -1) is obtained from the central coefficients c[n] of (a + b*x + b/x)^n, which satisfy a three terms recurrence
+@nb.njit(nogil=True, cache=True)
+def tree_size_weights(a:float,b:float,maximum:int):
+    c = np.zeros(maximum+2)
+    c[0] = 1.0
+    c[1] = a
+    for n in range(2,maximum+2):
+        c[n] = ((2*n-1)*a*c[n-1] + (n-1)*(4*b*b-a*a)*c[n-2])/n
+    w = np.zeros(maximum+1)
+    for n in range(1,maximum+1):
+        w[n] = (c[n+1]-a*c[n])/(2*b)/n
+    return w
+
+# for each size n, sample the number k of applications of a sequence of kinds of size n conditioned to have k+1 variables,
+# with probability proportional to n!/(k!(k+1)!(n-2k-1)!) * b^(2k+1) * a^(n-2k-1), by inverting the uniform sample u
+@nb.njit(nogil=True, cache=True)
+def sample_application_counts(sizes:np.array(np.int64),a:float,b:float,u:np.array(np.float64)):
+    counts = np.zeros(sizes.size, dtype=np.int64)
+    for j in range(sizes.size):
+        n = sizes[j]
+        m = (n-1)//2
+        lw = np.zeros(m+1)
+        for k in range(m+1):
+            lw[k] = -math.lgamma(k+1)-math.lgamma(k+2)-math.lgamma(n-2*k)+(2*k+1)*math.log(b)
+            if n-2*k-1 > 0:
+                lw[k] += (n-2*k-1)*math.log(a) if a > 0 else -np.inf
+        top = np.max(lw)
+        total = 0.0
+        for k in range(m+1):
+            lw[k] = math.exp(lw[k]-top)
+            total += lw[k]
+        target = u[j]*total
+        acc = 0.0
+        k = 0
+        while k < m:
+            acc += lw[k]
+            if acc > target: break
+            k += 1
+        counts[j] = k
+    return counts
+
+# shuffle in place each of the concatenated sequences of v (Fisher-Yates), driven by the uniform sample u
+@nb.njit(nogil=True, cache=True)
+def shuffle_segmented(v:np.array(np.int64),offsets:np.array(np.int64),u:np.array(np.float64)):
+    for j in range(offsets.size-1):
+        s = offsets[j]
+        for i in range(offsets[j+1]-1,s,-1):
+            k = s + int(u[i]*(i-s+1))
+            t = v[i]
+            v[i] = v[k]
+            v[k] = t
+    return v
+
+# outcome of a normalization
+NORMALIZED = 0
+STEP_LIMIT = 1
+SIZE_LIMIT = 2
+
+# index of the last node of the subterm starting at index, in a vector of kinds
+@nb.njit(cache=True)
+def subterm_end(kind, index):
+    need = 1
+    j = index
+    while need > 0:
+        need += kind[j]
+        j += 1
+    return j-1
+
+# mark the free variables of the subterm of kind between start and end (included), counting the abstractions above
+# each node in the subterm with a stack of the abstraction heights of pending arguments
+@nb.njit(cache=True)
+def mark_free(kind, indices, start, end, free, stack):
+    d = 0
+    sp = 0
+    for j in range(start, end+1):
+        if kind[j] == 0:
+            d += 1
+        elif kind[j] == 1:
+            stack[sp] = d
+            sp += 1
+        else:
+            free[j-start] = indices[j] > d
+            if sp > 0:
+                sp -= 1
+                d = stack[sp]
+
+# position of a redex at or after start (leftmost = True) or at or before start (leftmost = False), -1 if there is none
+@nb.njit(cache=True)
+def find_redex(kind, n, start, leftmost):
+    if leftmost:
+        for i in range(max(start,0), n-1):
+            if kind[i] == 1 and kind[i+1] == 0: return i
+    else:
+        for i in range(min(start,n-2), -1, -1):
+            if kind[i] == 1 and kind[i+1] == 0: return i
+    return -1
+
+# grow a buffer to hold at least size elements, keeping its first n elements
+@nb.njit(cache=True)
+def grow(buffer, size, n):
+    if buffer.size >= size: return buffer
+    new = np.empty(max(size, 2*buffer.size), dtype=buffer.dtype)
+    new[:n] = buffer[:n]
+    return new
+
+# reduce the term given by its kinds and De Bruijn indices, always at the leftmost (or rightmost) redex, until it is normal,
+# max_steps steps have been performed, or the next step would make it larger than max_size.
+# the term is reduced in place in grow-only buffers: each step only writes the reduced redex and shifts what follows it.
+# when forced is not empty, the redexes at the positions forced[0], forced[1]... are reduced instead, one per step.
+# with record=True, the position of the redex, the number of nodes it occupied and the number of nodes of its
+# reduct are recorded at each step.
+# returns the reduced kinds and indices, the number of steps, the outcome, the largest size reached and the records
+@nb.njit(cache=True)
+def reduce_loop(kind, indices, leftmost, max_steps, max_size, forced, record):
+    n = kind.size
+    kind = kind.copy()
+    indices = indices.copy()
+    region_kind = np.empty(16, dtype=kind.dtype)
+    region_indices = np.empty(16, dtype=indices.dtype)
+    stack = np.empty(16, dtype=np.int64)
+    free = np.empty(16, dtype=np.bool_)
+    positions = np.empty(16 if record else 0, dtype=np.int64)
+    removed = np.empty(16 if record else 0, dtype=np.int64)
+    inserted = np.empty(16 if record else 0, dtype=np.int64)
+    if forced.size > 0:
+        max_steps = forced.size
+    steps = 0
+    peak = n
+    status = NORMALIZED
+    r = find_redex(kind, n, 0 if leftmost else n-2, leftmost)
+    while r >= 0:
+        if steps == max_steps:
+            status = STEP_LIMIT
+            break
+        if forced.size > 0:
+            r = forced[steps]
+            if r < 0 or r >= n-1 or kind[r] != 1 or kind[r+1] != 0:
+                raise ValueError('no redex at the forced position')
+        # the redex is (λ body) arg
+        body_start = r+2
+        body_end = subterm_end(kind, body_start)
+        arg_start = body_end+1
+        arg_end = subterm_end(kind, arg_start)
+        m = arg_end-arg_start+1
+        stack = grow(stack, arg_end-r+1, 0)
+        free = grow(free, m, 0)
+        mark_free(kind, indices, arg_start, arg_end, free, stack)
+        # count the variables bound to the abstraction of the redex
+        d = 0
+        sp = 0
+        bound = 0
+        for j in range(body_start, body_end+1):
+            if kind[j] == 0:
+                d += 1
+            elif kind[j] == 1:
+                stack[sp] = d
+                sp += 1
+            else:
+                if indices[j] == d+1: bound += 1
+                if sp > 0:
+                    sp -= 1
+                    d = stack[sp]
+        length = body_end-body_start+1 + bound*(m-1)
+        size = n - (arg_end-r+1) + length
+        if size > max_size:
+            status = SIZE_LIMIT
+            break
+        # write the body with the argument substituted to its bound variables
+        region_kind = grow(region_kind, length, 0)
+        region_indices = grow(region_indices, length, 0)
+        d = 0
+        sp = 0
+        p = 0
+        for j in range(body_start, body_end+1):
+            k = kind[j]
+            if k == 0:
+                region_kind[p] = k
+                region_indices[p] = indices[j]
+                p += 1
+                d += 1
+            elif k == 1:
+                region_kind[p] = k
+                region_indices[p] = indices[j]
+                p += 1
+                stack[sp] = d
+                sp += 1
+            else:
+                if indices[j] == d+1:
+                    for t in range(m):
+                        region_kind[p] = kind[arg_start+t]
+                        region_indices[p] = indices[arg_start+t] + d if free[t] and kind[arg_start+t] == -1 else indices[arg_start+t]
+                        p += 1
+                else:
+                    region_kind[p] = k
+                    region_indices[p] = indices[j]-1 if indices[j] > d else indices[j]
+                    p += 1
+                if sp > 0:
+                    sp -= 1
+                    d = stack[sp]
+        # shift what follows the redex and copy the reduced redex in place
+        shift = length - (arg_end-r+1)
+        kind = grow(kind, size, n)
+        indices = grow(indices, size, n)
+        if shift > 0:
+            for j in range(n-1, arg_end, -1):
+                kind[j+shift] = kind[j]
+                indices[j+shift] = indices[j]
+        elif shift < 0:
+            for j in range(arg_end+1, n):
+                kind[j+shift] = kind[j]
+                indices[j+shift] = indices[j]
+        kind[r:r+length] = region_kind[:length]
+        indices[r:r+length] = region_indices[:length]
+        if record:
+            positions = grow(positions, steps+1, steps)
+            removed = grow(removed, steps+1, steps)
+            inserted = grow(inserted, steps+1, steps)
+            positions[steps] = r
+            removed[steps] = arg_end-r+1
+            inserted[steps] = length
+        n = size
+        peak = max(peak, n)
+        steps += 1
+        if forced.size > 0 and steps < forced.size:
+            continue
+        # only the reduced redex and the node before it may have changed
+        r = find_redex(kind, n, r-1 if leftmost else r+length-1, leftmost)
+    return kind[:n].copy(), indices[:n].copy(), steps, status, peak, positions[:steps].copy(), removed[:steps].copy(), inserted[:steps].copy()
+
+@nb.njit(cache=True)
+def normalize_kernel(kind, indices, leftmost, max_steps, max_size):
+    kind, indices, steps, status, peak, _, _, _ = reduce_loop(kind, indices, leftmost, max_steps, max_size, np.zeros(0, dtype=np.int64), False)
+    return kind, indices, steps, status, peak
+
+# write the decimal digits of value in out at position p, returns the position after them
+@nb.njit(cache=True)
+def emit_int(out, p, value):
+    if value < 0:
+        out[p] = 45 # '-'
+        p += 1
+        value = -value
+    start = p
+    while True:
+        out[p] = 48 + value % 10
+        p += 1
+        value //= 10
+        if value == 0: break
+    # the digits were written from the least significant one
+    end = p-1
+    while start < end:
+        t = out[start]
+        out[start] = out[end]
+        out[end] = t
+        start += 1
+        end -= 1
+    return p
+
+# write the utf-8 encoding of the nodes start, start+1, ... of a term as in polish_de_bruijn or parenthesis_de_bruijn
+# (parenthesis = True) in the byte buffer out, until the next node does not fit. The kinds are recovered from the
+# application kernel and, for the closing parenthesis, the height of the next node is read from a stack of the heights
+# of the pending arguments, so that no vector of the size of the term is allocated. As in parenthesis_de_bruijn, the
+# final '))' is cut to the longest run of closing parenthesis after a variable (at least one), kept in widest.
+# returns the next node to write, the number of bytes written, and the new height, stack and widest run
+@nb.njit(cache=True)
+def emit_de_bruijn(application_kernel, indices, start, parenthesis, out, height, stack, sp, widest):
+    n = application_kernel.size
+    p = 0
+    j = start
+    while j < n:
+        if j == n-1:
+            k = -1
+        else:
+            d = application_kernel[j+1]-application_kernel[j]
+            k = 1 if d > 0 else (0 if d == 0 else -1)
+        closing = 0
+        if parenthesis and k == -1 and j < n-1:
+            closing = max(height - stack[sp-1], 0)
+            widest = max(widest, closing)
+        # separator, longest integer, closing parenthesis and the two final ones
+        if p + 24 + closing > out.size: break
+        if j > 0:
+            out[p] = 32 # ' '
+            p += 1
+        if k == 0:
+            if parenthesis:
+                out[p] = 40 # '('
+                p += 1
+            out[p] = 0xCE # 'λ'
+            out[p+1] = 0xBB
+            p += 2
+            height += 1
+        elif k == 1:
+            out[p] = 40 if parenthesis else 64 # '(' or '@'
+            p += 1
+            if sp == stack.size:
+                stack = grow(stack, 2*sp, sp)
+            stack[sp] = height+1
+            sp += 1
+            height += 1
+        else:
+            p = emit_int(out, p, indices[j])
+            for t in range(closing):
+                out[p] = 41 # ')'
+                p += 1
+            if j == n-1:
+                if parenthesis:
+                    for t in range(min(widest, 2)):
+                        out[p] = 41
+                        p += 1
+            else:
+                sp -= 1
+                height = stack[sp]
+        j += 1
+    return j, p, height, stack, sp, widest
+
+# read the terms written one per line in data (utf-8 bytes) by polish_de_bruijn or parenthesis_de_bruijn, both notations
+# giving the nodes in the same order: 'λ' or '(λ' for abstractions, '@' or '(' for applications, integers for variables,
+# the closing parenthesis being ignored. When fill is True, the kinds, the De Bruijn indices (0 for non-variable nodes)
+# and the first node of each term are written in kind, indices and offsets.
+# returns the number of nodes, the number of terms, and the position of the first invalid byte or -1
+@nb.njit(cache=True)
+def parse_de_bruijn(data, kind, indices, offsets, fill):
+    size = data.size
+    n = 0
+    t = 0
+    need = 0 # number of subterms still missing in the current term, 0 outside of a term
+    done = False # the current line already holds a complete term
+    i = 0
+    while i < size:
+        c = data[i]
+        start = i
+        value = 0
+        if c == 40: # '(', followed by 'λ' for an abstraction
+            if i+2 < size and data[i+1] == 0xCE and data[i+2] == 0xBB:
+                k = 0
+                i += 3
+            else:
+                k = 1
+                i += 1
+        elif c == 0xCE and i+1 < size and data[i+1] == 0xBB: # 'λ'
+            k = 0
+            i += 2
+        elif c == 64: # '@'
+            k = 1
+            i += 1
+        elif (48 <= c <= 57) or c == 45: # an integer
+            sign = 1
+            if c == 45:
+                sign = -1
+                i += 1
+                if i == size or not 48 <= data[i] <= 57: return n, t, start
+            while i < size and 48 <= data[i] <= 57:
+                value = 10*value + data[i] - 48
+                i += 1
+            value *= sign
+            k = -1
+        elif c == 10: # end of a line
+            if need > 0: return n, t, start
+            done = False
+            i += 1
+            continue
+        elif c == 32 or c == 41 or c == 13 or c == 9: # ' ', ')', '\r', '\t'
+            i += 1
+            continue
+        else:
+            return n, t, start
+        if need == 0:
+            # the first node of a new term, which must be on a new line
+            if done: return n, t, start
+            if fill: offsets[t] = n
+            t += 1
+            need = 1
+        if fill:
+            kind[n] = k
+            indices[n] = value
+        n += 1
+        need += k
+        if need == 0:
+            done = True
+            if fill: offsets[t] = n
+    if need > 0: return n, t, size
+    return n, t, -1
+
+# seeds of the hashes of the three kinds of nodes
+VARIABLE_SEED = np.uint64(0x9E3779B97F4A7C15)
+ABSTRACTION_SEED = np.uint64(0xC2B2AE3D27D4EB4F)
+APPLICATION_SEED = np.uint64(0x165667B19E3779F9)
+
+# combine two 64 bits hashes (splitmix64 finalizer)
+@nb.njit(cache=True)
+def mix(a, b):
+    x = a ^ (b + np.uint64(0x9E3779B97F4A7C15) + (a << np.uint64(6)) + (a >> np.uint64(2)))
+    x ^= x >> np.uint64(30)
+    x *= np.uint64(0xBF58476D1CE4E5B9)
+    x ^= x >> np.uint64(27)
+    x *= np.uint64(0x94D049BB133111EB)
+    x ^= x >> np.uint64(31)
+    return x
+
+# Merkle hash of the subterm at each node, computed backward as in backward_integral: the hash of a variable
+# depends on its De Bruijn index, the hash of an abstraction on its body, and the hash of an application on its
+# function and its argument. With De Bruijn indices, two subterms are equal if and only if their arrays are equal,
+# so equal hashes mean equal subterms, up to collisions
+@nb.njit(nogil=True, cache=True)
+def fill_hashes(variable_kernel, kind, indices, h):
+    n = kind.size
+    for i in range(n-1,-1,-1):
+        if kind[i] == 0:
+            h[i] = mix(ABSTRACTION_SEED, h[i+1])
+        elif kind[i] == 1:
+            h[i] = mix(mix(APPLICATION_SEED, h[i+1]), h[variable_kernel[i+1]+1])
+        else:
+            h[i] = mix(VARIABLE_SEED, np.uint64(indices[i]))
+
+@nb.njit(cache=True)
+def subterm_hashes(variable_kernel:np.array(np.int64),kind:np.array(np.int64),indices:np.array(np.int64)):
+    h = np.zeros(kind.size, dtype=np.uint64)
+    fill_hashes(variable_kernel, kind, indices, h)
+    return h
+
+# subterm hashes of a forest of terms stored one after the other, with kernels relative to the first node of each term
+@nb.njit(nogil=True, cache=True)
+def subterm_hashes_segmented(variable_kernel:np.array(np.int64),kind:np.array(np.int64),indices:np.array(np.int64),offsets:np.array(np.int64)):
+    h = np.zeros(kind.size, dtype=np.uint64)
+    for j in range(offsets.size-1):
+        s = offsets[j]
+        e = offsets[j+1]
+        fill_hashes(variable_kernel[s:e], kind[s:e], indices[s:e], h[s:e])
+    return h
+
+# whether the terms a[j] and b[j] of a forest are equal, for each j. The indices of non-variable nodes are ignored
+@nb.njit(cache=True)
+def segments_equal(kind, indices, offsets, a, b):
+    equal = np.ones(a.size, dtype=np.bool_)
+    for j in range(a.size):
+        s1 = offsets[a[j]]
+        s2 = offsets[b[j]]
+        size = offsets[a[j]+1]-s1
+        if offsets[b[j]+1]-s2 != size:
+            equal[j] = False
+            continue
+        for i in range(size):
+            if kind[s1+i] != kind[s2+i] or (kind[s1+i] == -1 and indices[s1+i] != indices[s2+i]):
+                equal[j] = False
+                break
+    return equal
+
+# expand the node at root of a table of shared nodes (see dag.py) into the kinds and De Bruijn indices of the
+# corresponding tree, of the given size. Nodes are visited in prefix order with an explicit stack of the
+# subterms left to write: an abstraction pushes its body, an application its argument and then its function
+@nb.njit(nogil=True, cache=True)
+def flatten_dag(kind, left, right, index, root, size):
+    flat_kind = np.empty(size, dtype=np.int8)
+    flat_indices = np.zeros(size, dtype=np.int64)
+    stack = np.empty(size+1, dtype=np.int64)
+    stack[0] = root
+    sp = 1
+    j = 0
+    while sp > 0:
+        sp -= 1
+        node = stack[sp]
+        flat_kind[j] = kind[node]
+        if kind[node] == -1:
+            flat_indices[j] = index[node]
+        elif kind[node] == 0:
+            stack[sp] = left[node]
+            sp += 1
+        else:
+            stack[sp] = right[node]
+            stack[sp+1] = left[node]
+            sp += 2
+        j += 1
+    return flat_kind, flat_indices
+
+# add 1 to the pixel of image under each point (x, y), given in pixels. Points outside of the image are ignored
+@nb.njit(nogil=True, cache=True)
+def rasterize_points(image, x, y):
+    h, w = image.shape
+    for k in range(x.size):
+        i = int(np.floor(y[k]+0.5))
+        j = int(np.floor(x[k]+0.5))
+        if 0 <= i < h and 0 <= j < w:
+            image[i, j] += 1
+
+# add 1 to the pixels of image crossed by each segment (x0, y0)-(x1, y1), given in pixels. Each segment is first
+# clipped to the image (Liang-Barsky), then sampled once per pixel along its longest side
+@nb.njit(nogil=True, cache=True)
+def rasterize_segments(image, x0, y0, x1, y1):
+    h, w = image.shape
+    for k in range(x0.size):
+        dx = x1[k]-x0[k]
+        dy = y1[k]-y0[k]
+        t0 = 0.0
+        t1 = 1.0
+        visible = True
+        for p, q in ((-dx, x0[k]+0.5), (dx, w-0.5-x0[k]), (-dy, y0[k]+0.5), (dy, h-0.5-y0[k])):
+            if p == 0:
+                if q < 0: visible = False
+            elif p < 0:
+                t0 = max(t0, q/p)
+            else:
+                t1 = min(t1, q/p)
+        if not visible or t0 > t1: continue
+        n = int(max(abs(dx), abs(dy))*(t1-t0)) + 1
+        for s in range(n+1):
+            t = t0 + (t1-t0)*s/n
+            i = int(np.floor(y0[k]+t*dy+0.5))
+            j = int(np.floor(x0[k]+t*dx+0.5))
+            if 0 <= i < h and 0 <= j < w:
+                image[i, j] += 1
@@ -0,0 +1,219 @@
+import numpy as np
+import lambdaforge.computation as comp
+from .lambda_term import Lambda
+from .reduction import NORMALIZED, STEP_LIMIT, SIZE_LIMIT
+
+# a table of hash-consed nodes representing lambda terms with sharing. A term is the id of its root node, and every
+# subterm is stored once, so that the argument of a redex is shared by all the variables it replaces instead of
+# being copied for each of them. Children are always created before their parents, so that ids are in topological order.
+# for each node, the table holds:
+#   kind       variable:-1, abstraction:0, application:1
+#   left       the body of an abstraction, the function of an application
+#   right      the argument of an application
+#   index      the De Bruijn index of a variable
+#   size       the number of nodes of the tree obtained by expanding the sharing
+#   maxfree    the largest De Bruijn index of a free variable, relative to the node (0 for a closed term).
+#              substitutions and shifts leave the node unchanged under maxfree binders
+#   has_redex  whether the subterm contains a redex
+class LambdaDAG:
+    def __init__(self):
+        self.kind = []
+        self.left = []
+        self.right = []
+        self.index = []
+        self.size = []
+        self.maxfree = []
+        self.has_redex = []
+        self.table = {} # (kind, left or index, right) -> id of the node
+
+    def __len__(self):
+        return len(self.kind)
+
+    # the id of the node (kind, a, b), created if it is not in the table
+    def node(self, kind, a, b=0):
+        key = (kind, a, b)
+        n = self.table.get(key)
+        if n is not None:
+            return n
+        n = len(self.kind)
+        self.table[key] = n
+        self.kind.append(kind)
+        if kind == -1:
+            self.left.append(-1)
+            self.right.append(-1)
+            self.index.append(a)
+            self.size.append(1)
+            self.maxfree.append(a)
+            self.has_redex.append(False)
+        elif kind == 0:
+            self.left.append(a)
+            self.right.append(-1)
+            self.index.append(0)
+            self.size.append(1 + self.size[a])
+            self.maxfree.append(max(self.maxfree[a] - 1, 0))
+            self.has_redex.append(self.has_redex[a])
+        else:
+            self.left.append(a)
+            self.right.append(b)
+            self.index.append(0)
+            self.size.append(1 + self.size[a] + self.size[b])
+            self.maxfree.append(max(self.maxfree[a], self.maxfree[b]))
+            self.has_redex.append(self.kind[a] == 0 or self.has_redex[a] or self.has_redex[b])
+        return n
+
+    def variable(self, index): return self.node(-1, int(index))
+
+    def abstraction(self, body): return self.node(0, body)
+
+    def application(self, function, argument): return self.node(1, function, argument)
+
+    # adds a Lambda to the table, returns the id of its root
+    def from_lambda(self, l:Lambda):
+        kind = l.node_kind().tolist()
+        indices = l.de_bruijn_indices.tolist()
+        # build the nodes backward, the subterms of a node being on top of the stack when it is reached
+        stack = []
+        for i in range(l.size-1, -1, -1):
+            if kind[i] == -1:
+                stack.append(self.variable(indices[i]))
+            elif kind[i] == 0:
+                stack.append(self.abstraction(stack.pop()))
+            else:
+                function = stack.pop()
+                stack.append(self.application(function, stack.pop()))
+        return stack[0]
+
+    # the size of the term at root once the sharing is expanded, computed without expanding it
+    def flat_size(self, root): return self.size[root]
+
+    # expands the sharing of the term at root into a Lambda
+    def to_lambda(self, root):
+        kind, indices = comp.flatten_dag(np.array(self.kind, dtype=np.int8),
+                                         np.array(self.left, dtype=np.int64),
+                                         np.array(self.right, dtype=np.int64),
+                                         np.array(self.index, dtype=np.int64),
+                                         root, self.size[root])
+        return Lambda.from_kind(kind, indices)
+
+    # rebuild the term at root, found under depth binders, replacing each variable bound above root by leaf(index, depth)
+    # where depth is the number of binders above the variable. Subterms without such variables are kept as they are,
+    # and each shared subterm is rebuilt once per depth at which it appears
+    def rewrite(self, root, depth, leaf):
+        memo = {}
+        stack = [(root, depth, False)]
+        while stack:
+            n, c, expanded = stack.pop()
+            if (n, c) in memo:
+                continue
+            if self.maxfree[n] <= c:
+                memo[(n, c)] = n
+            elif self.kind[n] == -1:
+                memo[(n, c)] = leaf(self.index[n], c)
+            elif not expanded:
+                stack.append((n, c, True))
+                if self.kind[n] == 0:
+                    stack.append((self.left[n], c+1, False))
+                else:
+                    stack.append((self.right[n], c, False))
+                    stack.append((self.left[n], c, False))
+            elif self.kind[n] == 0:
+                memo[(n, c)] = self.abstraction(memo[(self.left[n], c+1)])
+            else:
+                memo[(n, c)] = self.application(memo[(self.left[n], c)], memo[(self.right[n], c)])
+        return memo[(root, depth)]
+
+    # add d to the indices of the free variables of the term at root
+    def shift(self, root, d):
+        if d == 0:
+            return root
+        return self.rewrite(root, 0, lambda k, c: self.variable(k + d))
+
+    # the body of an abstraction where the variables bound by it are replaced by argument
+    def substitute(self, body, argument):
+        shifted = {}
+        def leaf(k, c):
+            if k > c+1:
+                return self.variable(k-1)
+            # the argument is placed under c binders, shift it once for every depth
+            if c not in shifted:
+                shifted[c] = self.shift(argument, c)
+            return shifted[c]
+        return self.rewrite(body, 0, leaf)
+
+    # the id of the term at root after one step of beta reduction, at its leftmost redex (normal order) or at its
+    # rightmost one (applicative order), following the same order as the nodes of a Lambda
+    def reduce_step(self, root, leftmost=True):
+        if not self.has_redex[root]:
+            return root
+        # go down to the redex, remembering the path
+        path = []
+        n = root
+        while True:
+            if self.kind[n] == 0:
+                path.append(n)
+                n = self.left[n]
+                continue
+            f, a = self.left[n], self.right[n]
+            redex = self.kind[f] == 0
+            if leftmost and redex:
+                break
+            if leftmost:
+                below = f if self.has_redex[f] else a
+            elif self.has_redex[a]:
+                below = a
+            elif self.has_redex[f]:
+                below = f
+            else:
+                break
+            path.append(n)
+            n = below
+        # contract the redex and rebuild the path above it
+        reduced = self.substitute(self.left[self.left[n]], self.right[n])
+        for p in reversed(path):
+            if self.kind[p] == 0:
+                reduced = self.abstraction(reduced)
+            elif self.left[p] == n:
+                reduced = self.application(reduced, self.right[p])
+            else:
+                reduced = self.application(self.left[p], reduced)
+            n = p
+        return reduced
+
+    # reduce the term at root until it reaches a normal form, as reduction.normalize. max_size bounds the size
+    # of the expanded term, which may be much larger than the number of nodes of the table.
+    # returns the id of the reduced term, the number of steps performed and the outcome
+    def normalize(self, root, strategy='normal', max_steps=1000, max_size=None):
+        if strategy not in ('normal', 'applicative'):
+            raise ValueError("strategy should be 'normal' or 'applicative'")
+        steps = 0
+        while self.has_redex[root]:
+            if steps == max_steps:
+                return root, steps, STEP_LIMIT
+            reduced = self.reduce_step(root, strategy == 'normal')
+            if max_size is not None and self.size[reduced] > max_size:
+                return root, steps, SIZE_LIMIT
+            root = reduced
+            steps += 1
+        return root, steps, NORMALIZED
+
+    # a new table holding only the nodes reachable from roots, and the ids of roots in it
+    def collect(self, roots):
+        reachable = set()
+        stack = list(roots)
+        while stack:
+            n = stack.pop()
+            if n in reachable: continue
+            reachable.add(n)
+            if self.kind[n] != -1: stack.append(self.left[n])
+            if self.kind[n] == 1: stack.append(self.right[n])
+        dag = LambdaDAG()
+        ids = {}
+        # children have smaller ids than their parents
+        for n in sorted(reachable):
+            if self.kind[n] == -1:
+                ids[n] = dag.variable(self.index[n])
+            elif self.kind[n] == 0:
+                ids[n] = dag.abstraction(ids[self.left[n]])
+            else:
+                ids[n] = dag.application(ids[self.left[n]], ids[self.right[n]])
+        return dag, [ids[n] for n in roots]
@@ -1,19 +1,57 @@
 import numpy.random as rd
 import numpy as np
+import copy
+import functools
+import os
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 from dataclasses import dataclass
+import lambdaforge.computation as comp
+import lambdaforge.instrumentation as ins
 from .lambda_term import Lambda
+from .batch import LambdaBatch
+
+# the cumulative weights of the sizes between minimum and maximum of the trees of CGBW_tree(1 - 2 * b, b). They are
+# computed once for each set of parameters, so that sampling the size of a term does not cost O(maximum) each time
+@functools.lru_cache(maxsize=16)
+def size_cdf(b: float, minimum: int, maximum: int):
+    cdf = np.cumsum(comp.tree_size_weights(1 - 2 * b, b, maximum)[minimum:])
+    cdf.flags.writeable = False
+    return cdf
+
+# the variables that are not under any abstraction, given the kinds and the number of abstractions above each node
+def open_variables(kind, height_abs):
+    return (kind == -1) & (height_abs == 0)
 
 # a sampler for critical Bienaymé-Galton-Watson trees
 # with reproduction distribution b*delta_0 + a*delta_1 + b*delta_2
+# every sampler draws from rng, either a numpy Generator or the global numpy.random state
 @dataclass
 class CGBW_tree:
     a:float = 0.2
     b:float = 0.5 * 0.8
     
     # method to sample nodes from the tree
-    def sample_nodes(self, size: np.int64):
-        v = rd.rand(size)
-        return (v > (1 - self.b)) * 1 - (v < self.b) * 1
+    def sample_nodes(self, size: np.int64, rng=rd):
+        v = rng.random(size)
+        return (v > (1 - self.b)).astype(np.int8) - (v < self.b)
+
+    # method to sample the sizes of count trees conditioned to have between minimum and maximum nodes
+    def sample_sizes(self, minimum: int, maximum: int, count: int, rng=rd):
+        cdf = size_cdf(self.b, minimum, maximum)
+        return np.searchsorted(cdf, rng.random(count) * cdf[-1], side='right') + minimum
+
+    # method to sample the nodes of trees of given sizes, each sequence having exactly #variables-#applications=1.
+    # the sequences are concatenated and still need to be rotated
+    def sample_nodes_exact(self, sizes: np.array(np.int64), rng=rd):
+        offsets = np.concatenate(([0], np.cumsum(sizes)))
+        # sample the number of applications, the number of variables being one more
+        k = comp.sample_application_counts(sizes, 1 - 2 * self.b, self.b, rng.random(sizes.size))
+        segment = np.repeat(np.arange(sizes.size), sizes)
+        position = np.arange(offsets[-1]) - offsets[segment]
+        k = k[segment]
+        inc = (position < k).astype(np.int8) - ((position >= k) & (position < 2 * k + 1))
+        # shuffle the kinds inside each sequence
+        return comp.shuffle_segmented(inc, offsets, rng.random(inc.size))
         
 # a sampler for De Bruijn indices with geometric distribution
 @dataclass
@@ -21,8 +59,40 @@ class Geometric:
     p:float = 0.05
     
     # method to sample De Bruijn indices
-    def sample_de_bruijn(self, size: np.int64):
-        return rd.geometric(self.p, size)
+    def sample_de_bruijn(self, size: np.int64, rng=rd):
+        return rng.geometric(self.p, size)
+
+# De Bruijn samplers defining sample_de_bruijn_given receive the number of abstractions above each node
+# (Lambda.height_abs) instead of a size, and draw the index of each variable among the abstractions binding it
+# and free additional indices. free=0 gives closed terms, except for the variables that are not under any
+# abstraction, which can only be free and get the index 1: the Forge only samples trees without such variables
+# when closed=True
+
+# a geometric distribution of parameter p truncated to the indices between 1 and height_abs + free
+@dataclass
+class TruncatedGeometric:
+    p:float = 0.5
+    free:int = 0
+
+    def sample_de_bruijn_given(self, height_abs: np.array(np.int64), rng=rd):
+        bound = np.maximum(height_abs.astype(np.int64) + self.free, 1)
+        u = rng.random(bound.size)
+        if self.p >= 1:
+            return np.ones(bound.size, dtype=np.int64)
+        # inverse of the cumulative distribution function (1-q^k)/(1-q^bound) with q = 1-p
+        q = 1 - self.p
+        mass = -np.expm1(bound * np.log(q)) # 1-q^bound
+        k = np.ceil(np.log1p(-u * mass) / np.log(q))
+        return np.clip(k, 1, bound).astype(np.int64)
+
+# the index of each variable is uniform between 1 and height_abs + free
+@dataclass
+class UniformBinder:
+    free:int = 0
+
+    def sample_de_bruijn_given(self, height_abs: np.array(np.int64), rng=rd):
+        bound = np.maximum(height_abs.astype(np.int64) + self.free, 1)
+        return np.minimum((rng.random(bound.size) * bound).astype(np.int64) + 1, bound)
 
 # the lambda term sampler. It generates terms of size between minimum and maximum,
 # according to the tree_sampler and the de_bruijn_sampler specified
@@ -30,16 +100,33 @@ class Geometric:
 class Forge:
     minimum: int = 10
     maximum: int = 100
+    block_size: int = 2**22 # maximum number of increments drawn at once by craft_many
+    exact_size: bool = False # sample the size first and then the nodes of a tree of this size, instead of retrying nodes_may_fail
+    seed: object = None # an integer, a SeedSequence or a Generator. When None, the global numpy.random state is used
+    closed: bool = False # with a sampler defining sample_de_bruijn_given, only keep the trees in which every variable is under an abstraction
     tree_sampler = CGBW_tree()
     de_bruijn_sampler = Geometric()
+
+    def __post_init__(self):
+        if self.seed is None:
+            self.rng = rd
+        elif isinstance(self.seed, np.random.Generator):
+            self.rng = self.seed
+        else:
+            self.rng = np.random.default_rng(self.seed)
     
     # method to sample the tree structure through the node kinds. (variables:-1,abstractions:0,application:1)
     # a valid set of kinds is such that #variables-#applications=1
     def nodes_may_fail(self):
+        ins.count('forge.attempts')
         # sample nodes
-        inc = self.tree_sampler.sample_nodes(self.maximum)
+        t = ins.start()
+        inc = self.tree_sampler.sample_nodes(self.maximum, self.rng)
+        ins.stop('forge.rng', t)
         # compute the cumulative sum
+        t = ins.start()
         s = np.cumsum(inc)
+        ins.stop('forge.cumsum', t)
         # check if the list of increments reaches the minimum size
         if s[self.minimum - 1] == -1:
             return inc[:self.minimum], s[:self.minimum]
@@ -51,10 +138,19 @@ class Forge:
             else:
                 return None
     
+    # sample a sequence of nodes of a size drawn from the size distribution of the trees between minimum and maximum
+    def nodes_exact(self):
+        size = self.tree_sampler.sample_sizes(self.minimum, self.maximum, 1, self.rng)
+        inc = self.tree_sampler.sample_nodes_exact(size, self.rng)
+        return inc, np.cumsum(inc)
+
     # try sampling a valid set of nodes until it find a valid one
     def nodes(self):
+        if self.exact_size:
+            return self.nodes_exact()
         l = self.nodes_may_fail()
         while l == None:
+            ins.count('forge.rejections')
             l = self.nodes_may_fail()
         inc, s = l
         return inc, s
@@ -71,9 +167,165 @@ class Forge:
     
     # sample a lambda term
     def craft(self) -> Lambda:
-        inc, s = self.nodes()
-        inc, s = self.rotation(inc, s)
+        given = hasattr(self.de_bruijn_sampler, 'sample_de_bruijn_given')
+        while True:
+            t = ins.start()
+            inc, s = self.nodes()
+            ins.stop('forge.nodes', t)
+            t = ins.start()
+            inc, s = self.rotation(inc, s)
+            ins.stop('forge.rotation', t)
+            if not given: break
+            # compute the tree first, and sample the indices given the abstractions above each variable
+            t = ins.start()
+            l = Lambda.from_kind(inc, np.ones(inc.size, dtype=np.int8))
+            ins.stop('forge.kernels', t)
+            if not (self.closed and np.any(open_variables(l.node_kind(), l.height_abs()))): break
+            ins.count('forge.open_trees')
+        ins.count('forge.terms')
+        if given:
+            t = ins.start()
+            var_ind = self.de_bruijn_sampler.sample_de_bruijn_given(l.height_abs(), self.rng)
+            ins.stop('forge.de_bruijn', t)
+            return Lambda(l.size, l.abstraction_kernel, l.application_kernel, l.variable_kernel, comp.narrow_de_bruijn(var_ind))
         # sample De Bruijn indices
-        var_ind = self.de_bruijn_sampler.sample_de_bruijn(inc.size)
+        t = ins.start()
+        var_ind = self.de_bruijn_sampler.sample_de_bruijn(inc.size, self.rng)
+        ins.stop('forge.de_bruijn', t)
         # create the Lambda term from the kinds and the indices
-        return Lambda.from_kind(inc, var_ind)
+        t = ins.start()
+        l = Lambda.from_kind(inc, var_ind)
+        ins.stop('forge.kernels', t)
+        return l
+
+    # sample the node kinds of count terms at once, each row being an independent attempt of nodes_may_fail.
+    # returns the kinds of all the terms concatenated, and the offsets of each term
+    def nodes_many_may_fail(self, count: int):
+        kinds = [np.zeros(0, dtype=np.int8)]
+        lengths = [np.zeros(0, dtype=np.int64)]
+        accepted = 0
+        drawn = 0
+        succeeded = 0
+        # bound the number of increments sampled at once
+        block = max(1, self.block_size // self.maximum)
+        while accepted < count:
+            # draw enough rows for the remaining terms, given the acceptance rate observed so far
+            rate = succeeded / drawn if succeeded > 0 else 1
+            rows = int(min(block, np.ceil((count - accepted) / rate)))
+            drawn += rows
+            ins.count('forge.attempts', rows)
+            t = ins.start()
+            inc = self.tree_sampler.sample_nodes(rows * self.maximum, self.rng).reshape(rows, self.maximum)
+            ins.stop('forge.rng', t)
+            t = ins.start()
+            s = np.cumsum(inc, axis=1)
+            ins.stop('forge.cumsum', t)
+            # search for the first -1 after the minimum size in each row
+            hit = s[:, self.minimum - 1:] == -1
+            valid = hit.any(axis=1)
+            succeeded += np.count_nonzero(valid)
+            ins.count('forge.rejections', rows - np.count_nonzero(valid))
+            inc = inc[valid][:count - accepted]
+            length = np.argmax(hit[valid][:count - accepted], axis=1) + self.minimum
+            kinds.append(inc[np.arange(self.maximum) < length[:, None]])
+            lengths.append(length)
+            accepted += length.size
+        length = np.concatenate(lengths)
+        return np.concatenate(kinds), np.concatenate(([0], np.cumsum(length))).astype(np.int64)
+
+    # sample the node kinds of count terms at once, concatenated and rotated, with the offsets of each term
+    def nodes_many(self, count: int):
+        t = ins.start()
+        if self.exact_size:
+            sizes = self.tree_sampler.sample_sizes(self.minimum, self.maximum, count, self.rng)
+            offsets = np.concatenate(([0], np.cumsum(sizes))).astype(np.int64)
+            inc = self.tree_sampler.sample_nodes_exact(sizes, self.rng)
+        else:
+            inc, offsets = self.nodes_many_may_fail(count)
+        ins.stop('forge.nodes', t)
+        t = ins.start()
+        inc = self.rotation_many(inc, offsets)
+        ins.stop('forge.rotation', t)
+        return inc, offsets
+
+    # rotate each of the concatenated sequences of increments at its first minimum, as in rotation
+    def rotation_many(self, inc, offsets):
+        sizes = np.diff(offsets)
+        segment = np.repeat(np.arange(sizes.size), sizes)
+        s = np.cumsum(inc)
+        start = np.concatenate(([0], s[offsets[1:-1] - 1]))
+        s = s - start[segment]
+        # position of the first minimum of each sequence
+        minimum = np.minimum.reduceat(s, offsets[:-1]) if sizes.size > 0 else s
+        at_minimum = np.flatnonzero(s == minimum[segment])
+        i = at_minimum[np.searchsorted(at_minimum, offsets[:-1])] - offsets[:-1] + 1
+        position = np.arange(inc.size) - offsets[segment]
+        return inc[offsets[segment] + (position + i[segment]) % sizes[segment]]
+
+    # sample count lambda terms in one vectorized pass and pack them in a LambdaBatch
+    def craft_many(self, count: int) -> LambdaBatch:
+        kind, offsets = self.nodes_many(count)
+        ins.count('forge.terms', count)
+        if hasattr(self.de_bruijn_sampler, 'sample_de_bruijn_given'):
+            t = ins.start()
+            b = LambdaBatch.from_kind(kind, np.ones(kind.size, dtype=np.int8), offsets)
+            ins.stop('forge.kernels', t)
+            if self.closed:
+                b = self.closed_trees(b, count)
+            t = ins.start()
+            var_ind = self.de_bruijn_sampler.sample_de_bruijn_given(b.height_abs(), self.rng)
+            ins.stop('forge.de_bruijn', t)
+            return LambdaBatch(b.offsets, b.abstraction_kernel, b.application_kernel, b.variable_kernel, comp.narrow_de_bruijn(var_ind))
+        # sample De Bruijn indices for all the terms at once
+        t = ins.start()
+        var_ind = self.de_bruijn_sampler.sample_de_bruijn(kind.size, self.rng)
+        ins.stop('forge.de_bruijn', t)
+        t = ins.start()
+        b = LambdaBatch.from_kind(kind, var_ind, offsets)
+        ins.stop('forge.kernels', t)
+        return b
+
+    # the terms of the batch b in which every variable is under an abstraction, completed by new trees sampled by
+    # batches until there are count of them
+    def closed_trees(self, b: LambdaBatch, count: int) -> LambdaBatch:
+        batches = []
+        while True:
+            sizes = np.diff(b.offsets)
+            segment = np.repeat(np.arange(sizes.size), sizes)
+            closed = np.ones(sizes.size, dtype=bool)
+            closed[segment[open_variables(b.node_kind(), b.height_abs())]] = False
+            ins.count('forge.open_trees', sizes.size - np.count_nonzero(closed))
+            keep = closed[segment]
+            offsets = np.concatenate(([0], np.cumsum(sizes[closed]))).astype(np.int64)
+            batches.append(LambdaBatch(offsets, b.abstraction_kernel[keep], b.application_kernel[keep], b.variable_kernel[keep], b.de_bruijn_indices[keep]))
+            count -= offsets.size - 1
+            if count == 0:
+                return LambdaBatch.concatenate(batches)
+            kind, offsets = self.nodes_many(count)
+            b = LambdaBatch.from_kind(kind, np.ones(kind.size, dtype=np.int8), offsets)
+
+    # sample count lambda terms over a pool of workers. The terms are sampled by chunks of chunk_size terms,
+    # each chunk drawing from its own stream spawned from the seed of the Forge, so that the result only
+    # depends on the seed and chunk_size, and not on the number of workers nor on the previous calls.
+    # the streams are spawned from a copy of the seed sequence, which leaves the one of the Forge unchanged
+    def craft_parallel(self, count: int, workers: int = None, chunk_size: int = 4096, processes: bool = False) -> LambdaBatch:
+        if self.seed is None:
+            seed_sequence = np.random.SeedSequence()
+        else:
+            seq = self.rng.bit_generator.seed_seq
+            seed_sequence = np.random.SeedSequence(seq.entropy, spawn_key=seq.spawn_key, pool_size=seq.pool_size)
+        counts = [min(chunk_size, count - i) for i in range(0, count, chunk_size)]
+        seeds = seed_sequence.spawn(len(counts))
+        # the global numpy.random state cannot be sent to other processes
+        template = copy.copy(self)
+        template.rng = None
+        executor = ProcessPoolExecutor if processes else ThreadPoolExecutor
+        with executor(max_workers=workers or os.cpu_count()) as pool:
+            batches = list(pool.map(craft_chunk, [template] * len(counts), seeds, counts))
+        return LambdaBatch.concatenate(batches)
+
+# sample a chunk of count terms with a copy of forge drawing from the stream seed
+def craft_chunk(forge: Forge, seed: np.random.SeedSequence, count: int) -> LambdaBatch:
+    forge = copy.copy(forge)
+    forge.rng = np.random.default_rng(seed)
+    return forge.craft_many(count)
@@ -0,0 +1,79 @@
+import numpy as np
+from collections import OrderedDict
+import lambdaforge.computation as comp
+from .lambda_term import Lambda
+from .batch import LambdaBatch
+
+# with De Bruijn indices, alpha-equivalent terms have equal arrays. Terms are compared through the Merkle hashes of
+# their subterms (comp.subterm_hashes), and equal hashes are always checked against the arrays before merging terms
+
+# the hash of a term
+def term_hash(l:Lambda) -> int:
+    return int(l.subterm_hashes()[0])
+
+# the hash of every term of a batch
+def batch_hashes(b:LambdaBatch):
+    h = comp.subterm_hashes_segmented(b.variable_kernel, b.node_kind(), b.de_bruijn_indices, b.offsets)
+    return h[b.offsets[:-1]]
+
+# the number of distinct subterms of l, according to their hashes
+def count_distinct_subterms(l:Lambda) -> int:
+    return np.unique(l.subterm_hashes()).size
+
+# remove the repeated terms of a batch. Returns the batch of distinct terms, in the order of their first occurrence,
+# the position of their first occurrence in b, and for each term of b the position of its copy in the new batch
+def deduplicate(b:LambdaBatch):
+    h = batch_hashes(b)
+    sizes = b.sizes()
+    # group the terms by hash and size, in the order of their first occurrence
+    keys = np.rec.fromarrays([h, sizes])
+    _, first, inverse = np.unique(keys, return_index=True, return_inverse=True)
+    order = np.argsort(first, kind='stable')
+    rank = np.empty_like(order)
+    rank[order] = np.arange(order.size)
+    first = first[order]
+    inverse = rank[inverse.reshape(-1)]
+    # check that each term equals the first term of its group, the others (hash collisions) are kept apart
+    representative = first[inverse]
+    equal = comp.segments_equal(b.node_kind(), b.de_bruijn_indices, b.offsets, np.arange(len(b)), representative)
+    collisions = np.flatnonzero(~equal)
+    if collisions.size > 0:
+        inverse[collisions] = first.size + np.arange(collisions.size)
+        first = np.concatenate((first, collisions))
+    unique = LambdaBatch.from_list([b[i] for i in first]) if first.size < len(b) else b
+    return unique, first, inverse
+
+# a bounded cache from terms to their normal forms, the least recently used entries being evicted first.
+# it is keyed by the hash and the size of the term and by the reduction strategy, hits being checked against the arrays
+class NormalFormCache:
+    def __init__(self, max_entries:int = 2**16):
+        self.max_entries = max_entries
+        self.entries = OrderedDict() # key -> list of (kind, indices, normal form, steps, largest size reached)
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, l:Lambda, strategy):
+        return term_hash(l), l.size, strategy
+
+    # the normal form of l, the number of steps and the largest size reached to compute it, or None
+    def get(self, l:Lambda, strategy='normal'):
+        key = self.key(l, strategy)
+        kind = l.node_kind()
+        for k, indices, result, steps, peak in self.entries.get(key, ()):
+            if np.array_equal(k, kind) and np.array_equal(np.where(kind == -1, l.de_bruijn_indices, 0), indices):
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return result, steps, peak
+        self.misses += 1
+        return None
+
+    def put(self, l:Lambda, strategy, result:Lambda, steps:int, peak:int):
+        key = self.key(l, strategy)
+        kind = np.array(l.node_kind())
+        self.entries.setdefault(key, []).append((kind, np.where(kind == -1, l.de_bruijn_indices, 0), result, steps, peak))
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self.entries)
@@ -0,0 +1,107 @@
+import math
+import threading
+import time
+from contextlib import contextmanager
+
+# opt-in instrumentation of the hot paths (sampling, operations on terms, reduction). When enabled is False, the
+# instrumented code only pays a test of this flag. When it is True, the events are gathered in counters and in
+# histograms (timings in seconds, sizes in bytes...), and sent to the registered callbacks as (name, value).
+#
+#   with instrumentation.collect() as stats:
+#       Forge(100, 1000).craft_many(10000)
+#   stats['counters']['forge.attempts'], stats['histograms']['forge.kernels']['total']
+#
+# histograms have one bucket per power of 2: the bucket k counts the values between 2^(k-1) and 2^k
+
+enabled = False
+counters = {}
+histograms = {}
+callbacks = []
+lock = threading.Lock()
+
+def enable():
+    global enabled
+    enabled = True
+
+def disable():
+    global enabled
+    enabled = False
+
+def reset():
+    with lock:
+        counters.clear()
+        histograms.clear()
+
+# call callback(name, value) on every event
+def subscribe(callback):
+    callbacks.append(callback)
+
+def unsubscribe(callback):
+    callbacks.remove(callback)
+
+# add value to the counter name
+def count(name, value=1):
+    if not enabled: return
+    value = int(value)
+    with lock:
+        counters[name] = counters.get(name, 0) + value
+    for callback in callbacks:
+        callback(name, value)
+
+# add value to the histogram name
+def observe(name, value):
+    if not enabled: return
+    value = float(value)
+    with lock:
+        h = histograms.get(name)
+        if h is None:
+            h = histograms[name] = {'count': 0, 'total': 0.0, 'min': math.inf, 'max': -math.inf, 'buckets': {}}
+        h['count'] += 1
+        h['total'] += value
+        h['min'] = min(h['min'], value)
+        h['max'] = max(h['max'], value)
+        bucket = math.frexp(value)[1] if value > 0 else None
+        h['buckets'][bucket] = h['buckets'].get(bucket, 0) + 1
+    for callback in callbacks:
+        callback(name, value)
+
+# timing of a section of code: t = start() ... stop(name, t). start returns None when the instrumentation is
+# disabled, and stop then does nothing
+def start():
+    return time.perf_counter() if enabled else None
+
+def stop(name, t):
+    if t is not None:
+        observe(name, time.perf_counter() - t)
+
+@contextmanager
+def timer(name):
+    t = start()
+    try:
+        yield
+    finally:
+        stop(name, t)
+
+# the counters and the histograms as a dict of plain values
+def snapshot():
+    with lock:
+        return {'counters': dict(counters),
+                'histograms': {name: {**h, 'mean': h['total'] / h['count'], 'buckets': dict(h['buckets'])} for name, h in histograms.items()}}
+
+# collect the events of a block of code. The yielded dict is filled with the snapshot when the block exits
+@contextmanager
+def collect():
+    global enabled
+    was_enabled = enabled
+    reset()
+    enabled = True
+    stats = {}
+    try:
+        yield stats
+    finally:
+        enabled = was_enabled
+        stats.update(snapshot())
+
+# the number of bytes of the arrays of a term
+def nbytes(l):
+    return l.abstraction_kernel.nbytes + l.application_kernel.nbytes + l.variable_kernel.nbytes + l.de_bruijn_indices.nbytes
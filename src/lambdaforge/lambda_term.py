@@ -1,8 +1,11 @@
 import numpy as np
 import lambdaforge.computation as comp 
+import lambdaforge.instrumentation as ins
+from lambdaforge.cache import cached, derived
 from dataclasses import dataclass
 
-@dataclass
+# the arrays of a term are not modified once it is created, which allows to cache the vectors derived from them
+@dataclass(frozen=True)
 class Lambda:
     size:np.int64
     abstraction_kernel:np.array(np.int64) # the index of the closest parent abstraction of each node
@@ -11,19 +14,29 @@ class Lambda:
     de_bruijn_indices:np.array(np.int64) # the de Bruijn index of each variable in the lambda term. Value for non-variable node is irrelevant
     
     # a static method that creates a Lambda object from a given kind vector (variable:-1,abstraction:0,applicatoin:1) and de Bruijn indices
+    # the kinds are stored as int8, the kernels and the indices in the narrowest integer type holding their values
     def from_kind(kind:np.array(np.int64),de_bruijn_indices:np.array(np.int64)):
-        abstraction_kernel,application_kernel,variable_kernel=comp.compute_kernel(kind)
-        return Lambda(kind.size, abstraction_kernel, application_kernel, variable_kernel, de_bruijn_indices)
+        t = ins.start()
+        # a copy of the kinds, which are cached and must not change with the array of the caller
+        kind = np.array(kind, dtype=np.int8)
+        abstraction_kernel,application_kernel,variable_kernel=comp.compute_kernel(kind, comp.index_dtype(kind.size))
+        l = Lambda(kind.size, abstraction_kernel, application_kernel, variable_kernel, comp.narrow_de_bruijn(np.asarray(de_bruijn_indices)))
+        # keep the kinds instead of deriving them again from the application kernel
+        derived.put(l, 'node_kind', kind)
+        ins.stop('lambda.from_kind', t)
+        return l
            
     # kind of each node (variable:-1,abstraction:0,applicatoin:1)
+    @cached
     def node_kind(self): 
         dq = np.roll(self.application_kernel,-1)-self.application_kernel # a numpy array of the difference between the application kernel and its shifted version
         dq[self.size-1] = -1 # set the last element of dq to -1
-        dq = np.sign(dq) # set each element of dq to its sign
+        dq = np.sign(dq).astype(np.int8) # set each element of dq to its sign
         return dq
     
     # returns the subterm of the lambda term rooted at a given index
     def subterm(self,index:int):
+        index = int(index) # keep the type of the kernels
         var = self.variable_kernel[index] # the index of the closest parent variable of the given index
         size = var+1-index # the size of the subterm rooted at the given index
         abstraction_kernel = self.abstraction_kernel[index:var+1]-index # a numpy array of the indices of the parent abstractions of the nodes in the subterm
@@ -36,24 +49,42 @@ class Lambda:
      
     # returns a new lambda term obtained by replacing the subterm at a given index with another lambda term that may capture variables
     def replace(self,index:int,other):
+        t = ins.start()
         var = self.variable_kernel[index]
-        abstraction_kernel = comp.forward_insert(self.abstraction_kernel, other.abstraction_kernel, index, var)
-        application_kernel = comp.forward_insert(self.application_kernel, other.application_kernel, index, var)
-        variable_kernel = comp.backward_insert(self.variable_kernel, other.variable_kernel, index, var)
-        de_bruijn_indices = comp.de_bruijn_insert(self.de_bruijn_indices,other.de_bruijn_indices,index, var)
+        # promote the kernels if the new term is too large for their type
+        dtype = comp.index_dtype(self.size - (var-index+1) + other.size)
+        dtype = np.promote_types(dtype, np.result_type(self.abstraction_kernel, other.abstraction_kernel))
+        indices_dtype = np.result_type(self.de_bruijn_indices, other.de_bruijn_indices)
+        abstraction_kernel = comp.forward_insert(self.abstraction_kernel, other.abstraction_kernel, index, var, dtype)
+        application_kernel = comp.forward_insert(self.application_kernel, other.application_kernel, index, var, dtype)
+        variable_kernel = comp.backward_insert(self.variable_kernel, other.variable_kernel, index, var, dtype)
+        de_bruijn_indices = comp.de_bruijn_insert(self.de_bruijn_indices,other.de_bruijn_indices,index, var, indices_dtype)
         
-        return Lambda(abstraction_kernel.size, abstraction_kernel, application_kernel, variable_kernel, de_bruijn_indices)
+        l = Lambda(abstraction_kernel.size, abstraction_kernel, application_kernel, variable_kernel, de_bruijn_indices)
+        if t is not None:
+            ins.stop('lambda.replace', t)
+            ins.observe('lambda.replace.bytes', ins.nbytes(l))
+        return l
 
     # capture avoiding substitution of 'other' for each variable in 'variables'
     def substitute(self,variables,other):
-        abstraction_kernel = comp.forward_substitute(self.abstraction_kernel, other.abstraction_kernel,  variables)
-        application_kernel = comp.forward_substitute(self.application_kernel, other.application_kernel, variables)
-        variable_kernel = comp.backward_substitute(self.variable_kernel, other.variable_kernel, variables)
-        de_bruijn_indices = self.de_bruijn_indices
+        t = ins.start()
         habs = self.height_abs()
-        de_bruijn_indices = np.where(de_bruijn_indices>habs,de_bruijn_indices-1,de_bruijn_indices)
-        de_bruijn_indices =  comp.de_bruijn_substitute(de_bruijn_indices, other.de_bruijn_indices, variables, habs, other.free_var())
-        return Lambda(abstraction_kernel.size, abstraction_kernel, application_kernel, variable_kernel, de_bruijn_indices)
+        # promote the kernels and the indices if the new term is too large for their type
+        dtype = comp.index_dtype(self.size + variables.size * (other.size-1))
+        dtype = np.promote_types(dtype, np.result_type(self.abstraction_kernel, other.abstraction_kernel))
+        indices_dtype = comp.de_bruijn_dtype(min(np.min(self.de_bruijn_indices)-1, np.min(other.de_bruijn_indices)),
+                                             max(np.max(self.de_bruijn_indices), np.max(other.de_bruijn_indices)+np.max(habs)))
+        indices_dtype = np.promote_types(indices_dtype, np.result_type(self.de_bruijn_indices, other.de_bruijn_indices))
+        abstraction_kernel,application_kernel,variable_kernel,de_bruijn_indices = comp.substitute(
+            self.abstraction_kernel, self.application_kernel, self.variable_kernel, self.de_bruijn_indices,
+            other.abstraction_kernel, other.application_kernel, other.variable_kernel, other.de_bruijn_indices,
+            variables, habs, other.free_var(), dtype, indices_dtype)
+        l = Lambda(abstraction_kernel.size, abstraction_kernel, application_kernel, variable_kernel, de_bruijn_indices)
+        if t is not None:
+            ins.stop('lambda.substitute', t)
+            ins.observe('lambda.substitute.bytes', ins.nbytes(l))
+        return l
         
     # indicator vector of applications
     def applications(self): return np.clip(self.node_kind(),0,1)
@@ -62,6 +93,7 @@ class Lambda:
     def abstractions(self): return 1-np.abs(self.node_kind())
 
     # indicator vector of variables
+    @cached
     def variables(self): return np.clip(-self.node_kind(),0,1)
     # indices of applications
     def applications_node(self): return self.applications() * np.arange(self.size)
@@ -75,49 +107,47 @@ class Lambda:
     def parents(self): 
         ap = np.max([self.abstraction_kernel,self.application_kernel,np.roll(self.application_kernel,1)],axis=0)
         return ap
+    # for each node, the index of the abstraction at the given distance above it (1 for the closest one), -1 if there is none
+    def abstraction_at_distance(self, distance: np.array(np.int64)):
+        return comp.abstraction_ancestors(self.node_kind(), self.height_abs(), distance, self.abstraction_kernel.dtype)
+
     # vector with the index of the abstraction of each bounded variable, and the amount of necessary
     # abstraction beyond the root of the term to make a free variable bounded
+    @cached
     def bindings(self): 
-        # search for abstractions at a certain distance, in place, initialize at 1
-        abs_at_distance = self.abstraction_kernel 
+        t = ins.start()
         # get the variables that are bounded by abstractions
         bounded_var = self.bounded_var() 
-        # get the maximum De Bruijn index of bounded variables
-        max_depth = np.max(bounded_var * self.de_bruijn_indices) 
-        
-        # initialize future bindings
-        b = np.zeros(self.size, int) 
-        
-        # for each depth level, look for abstractions at distance +1 and report their position to the variable
-        for i in range(max_depth):
-            # determine whether or not the variable at this index has De Bruijn index i+1
-            to_replace = (self.de_bruijn_indices == i+1) * bounded_var 
-            # update the bindings where to_replace is 1
-            b = to_replace * abs_at_distance + (1-to_replace) * b
-            # search for the abstractions at distance +1
-            abs_at_distance = self.abstraction_kernel[abs_at_distance] 
+        # look for the abstraction at distance given by the De Bruijn index of each bounded variable
+        b = self.abstraction_at_distance(self.de_bruijn_indices * bounded_var) * bounded_var
         
         # determine the number of abstractions before the root that should be added to close bind the free variable
         free_bindings = (self.de_bruijn_indices-self.height_abs()+1) * self.free_var()
         # store this information with negative integers in b
         b -= free_bindings
+        ins.stop('lambda.bindings', t)
         return b  
 
     # for each node i, sum the input vector v between v and the root
+    # the result has the type of v, promoted to the type of the kernels
     def forward_integral(self, v: np.array(np.int64)): 
-        return comp.forward_integral(self.application_kernel, self.node_kind(), v)
+        v = np.asarray(v)
+        return comp.forward_integral(self.application_kernel, self.node_kind(), v.astype(np.result_type(v, self.application_kernel), copy=False))
 
     # for each node i, sum the input vector v on  the subtree at index i
     def backward_integral(self, v: np.array(np.int64)): 
-        return comp.backward_integral(self.variable_kernel, self.node_kind(), v)
+        v = np.asarray(v)
+        return comp.backward_integral(self.variable_kernel, self.node_kind(), v.astype(np.result_type(v, self.variable_kernel), copy=False))
 
     # get the height process of the tree
+    @cached
     def height(self) -> np.array(int):
-        ones = np.ones(self.size, dtype=np.int64)
+        ones = np.ones(self.size, dtype=self.application_kernel.dtype)
         h = self.forward_integral(ones)
         return h
 
     # get the number of bastraction below each node
+    @cached
     def height_abs(self): 
         return self.forward_integral(self.abstractions())
 
@@ -136,6 +166,11 @@ class Lambda:
         y_pos = self.height()
         return x_pos, y_pos
 
+    # hash of the subterm at each node, equal subterms having equal hashes
+    @cached
+    def subterm_hashes(self):
+        return comp.subterm_hashes(self.variable_kernel, self.node_kind(), self.de_bruijn_indices)
+
     # compute the redex of the tree
     def redex(self):
         return self.applications() * np.roll(self.abstractions(),-1)
@@ -0,0 +1,71 @@
+import numpy as np
+import lambdaforge.computation as comp
+from .lambda_term import Lambda
+from .batch import LambdaBatch
+
+# tokenize the terms in data (str or utf-8 bytes), one per line, written by polish_de_bruijn or parenthesis_de_bruijn.
+# returns the concatenated kinds and De Bruijn indices, and the offsets of the terms
+def parse_arrays(data):
+    if isinstance(data, str):
+        data = data.encode()
+    data = np.frombuffer(data, dtype=np.uint8)
+    empty = np.zeros(0, dtype=np.int8)
+    # count the nodes and the terms, then fill the arrays
+    n, t, error = comp.parse_de_bruijn(data, empty, empty.astype(np.int64), empty.astype(np.int64), False)
+    if error == data.size:
+        raise ValueError('incomplete term at the end of the input')
+    if error >= 0:
+        raise ValueError(f'invalid term at byte {error}: {bytes(data[error:error+20])!r}')
+    kind = np.empty(n, dtype=np.int8)
+    indices = np.empty(n, dtype=np.int64)
+    offsets = np.zeros(t+1, dtype=np.int64)
+    comp.parse_de_bruijn(data, kind, indices, offsets, True)
+    return kind, indices, offsets
+
+# build the Lambda written in text by polish_de_bruijn or parenthesis_de_bruijn
+def parse_de_bruijn(text) -> Lambda:
+    kind, indices, offsets = parse_arrays(text)
+    if offsets.size != 2:
+        raise ValueError(f'expected one term, found {offsets.size-1}')
+    return Lambda.from_kind(kind, indices)
+
+def parse_polish_de_bruijn(text) -> Lambda:
+    return parse_de_bruijn(text)
+
+def parse_parenthesis_de_bruijn(text) -> Lambda:
+    return parse_de_bruijn(text)
+
+# build a LambdaBatch from text holding one term per line
+def parse_de_bruijn_batch(text) -> LambdaBatch:
+    kind, indices, offsets = parse_arrays(text)
+    return LambdaBatch.from_kind(kind, indices, offsets)
+
+# read a file holding one term per line (a path or a binary file-like object) by blocks of block_size bytes,
+# and pack the terms in a LambdaBatch
+def read_de_bruijn(file, block_size:int = 2**24) -> LambdaBatch:
+    if isinstance(file, (str, bytes)) or hasattr(file, '__fspath__'):
+        with open(file, 'rb') as f:
+            return read_de_bruijn(f, block_size)
+    kinds, indices, sizes = [], [], []
+    # the pieces of the last line, not complete yet. They are joined once its end is read, so that a line spanning
+    # many blocks is only copied once
+    pending = []
+    while True:
+        block = file.read(block_size)
+        if block:
+            # only parse the complete lines, the last one is continued by the next block
+            end = block.rfind(b'\n') + 1
+            if end == 0:
+                pending.append(block)
+                continue
+            data = b''.join(pending + [block[:end]])
+            pending = [block[end:]]
+        else:
+            data = b''.join(pending)
+        k, i, o = parse_arrays(data)
+        kinds.append(k)
+        indices.append(i)
+        sizes.append(np.diff(o))
+        if not block: break
+    sizes = np.concatenate(sizes)
+    return LambdaBatch.from_kind(np.concatenate(kinds), np.concatenate(indices), np.concatenate(([0], np.cumsum(sizes))))
@@ -1,4 +1,5 @@
 import numpy as np
+import lambdaforge.computation as comp
 from lambdaforge.lambda_term import Lambda
 
 def parenthesis_de_bruijn(l:Lambda):
@@ -67,3 +68,34 @@ def polish_named(l:Lambda,abs_names,free_var_names,lambda_sym='λ',app_sym='@'):
                                       '@')))
 
     return ' '.join(word)     
+
+# generate the utf-8 encoding of parenthesis_de_bruijn(l) (parenthesis = True) or polish_de_bruijn(l) by chunks of at most
+# chunk_size bytes. The chunks are written by a compiled emitter, which only keeps a stack of the size of the height of the term
+def iter_de_bruijn(l:Lambda, parenthesis:bool, chunk_size:int = 2**20):
+    out = np.empty(max(chunk_size, 64), dtype=np.uint8)
+    stack = np.empty(64, dtype=np.int64)
+    height, sp, widest, j = 0, 0, 1, 0
+    while j < l.size:
+        next_j, p, height, stack, sp, widest = comp.emit_de_bruijn(l.application_kernel, l.de_bruijn_indices, j, parenthesis, out, height, stack, sp, widest)
+        if next_j == j:
+            # a variable closes more parenthesis than the buffer can hold
+            out = np.empty(2 * out.size, dtype=np.uint8)
+            continue
+        j = next_j
+        yield out[:p].tobytes()
+
+def iter_parenthesis_de_bruijn(l:Lambda, chunk_size:int = 2**20):
+    return iter_de_bruijn(l, True, chunk_size)
+
+def iter_polish_de_bruijn(l:Lambda, chunk_size:int = 2**20):
+    return iter_de_bruijn(l, False, chunk_size)
+
+# write parenthesis_de_bruijn(l) in utf-8 to a binary file-like object, without building the string
+def write_parenthesis_de_bruijn(l:Lambda, file, chunk_size:int = 2**20):
+    for chunk in iter_parenthesis_de_bruijn(l, chunk_size):
+        file.write(chunk)
+
+# write polish_de_bruijn(l) in utf-8 to a binary file-like object, without building the string
+def write_polish_de_bruijn(l:Lambda, file, chunk_size:int = 2**20):
+    for chunk in iter_polish_de_bruijn(l, chunk_size):
+        file.write(chunk)
@@ -1,8 +1,14 @@
+import time
 import numpy as np
+import lambdaforge.computation as comp
+import lambdaforge.instrumentation as ins
 from lambdaforge.lambda_term import Lambda
+from lambdaforge.view import LambdaView
 
 # perform one step of beta reduction at a specified index in the lambda term
+# with the instrumentation enabled, the time of the step and the number of bytes of the arrays it allocates are recorded
 def reduce_at(l:Lambda, index):
+    t = ins.start()
     # get the subterm under the abstraction of the redex
     l1 = l.subterm(index + 2)
     # get the number of abstractions under each nodes in l1
@@ -14,7 +20,24 @@ def reduce_at(l:Lambda, index):
     # Substitute the bounded variables in l1 with the argument
     l3 = l1.substitute(variables, l2)
     # Replace the redex with the result of the substitution
-    return l.replace(index, l3)
+    result = l.replace(index, l3)
+    if t is not None:
+        ins.stop('reduction.reduce_at', t)
+        ins.observe('reduction.reduce_at.bytes', ins.nbytes(l1) + ins.nbytes(l2) + ins.nbytes(l3) + ins.nbytes(result))
+        ins.count('reduction.steps')
+    return result
+
+# perform one step of beta reduction at a specified index in a view of a lambda term (see view.py). Only the
+# body and the argument of the redex are copied, the rest of the term is shared with the view
+def reduce_view_at(v:LambdaView, index):
+    t = ins.start()
+    l1 = v.subterm(index + 2).to_lambda()
+    habs = l1.height_abs()
+    variables = np.flatnonzero((l1.de_bruijn_indices == habs + 1) * l1.variables())
+    l2 = v.subterm(int(v.read('variable_kernel', index + 1, index + 2)[0]) + 1).to_lambda()
+    result = v.replace(index, l1.substitute(variables, l2))
+    ins.stop('reduction.reduce_view_at', t)
+    return result
 
 # perform one step of beta reduction using normal order
 def reduce_normal_order_step(l:Lambda):
@@ -36,3 +59,56 @@ def reduce_applicative_order_step(l:Lambda):
     i = len(r) - np.argmax(r) - 1 # find the index of the rightmost redex in the original array
     # reduce at the rightmost redex
     return reduce_at(l, i)
+
+# outcomes of normalize
+NORMALIZED = comp.NORMALIZED   # the term is in normal form
+STEP_LIMIT = comp.STEP_LIMIT   # max_steps steps were performed and the term still has a redex
+SIZE_LIMIT = comp.SIZE_LIMIT   # the next step would make the term larger than max_size
+TIMEOUT = 3                    # the time budget was spent before reaching a normal form
+# names of the outcomes, as reported by the instrumentation
+OUTCOME_NAMES = {NORMALIZED: 'normalized', STEP_LIMIT: 'step_limit', SIZE_LIMIT: 'size_limit', TIMEOUT: 'timeout'}
+
+# run normalize_kernel on the kinds and the De Bruijn indices of a term. With a timeout (in seconds), the compiled
+# loop runs by rounds of check_steps steps, and the reduction stops with TIMEOUT when the time budget is spent
+def normalize_arrays(kind, indices, leftmost, max_steps, max_size, timeout=None, check_steps=64):
+    if timeout is None:
+        return comp.normalize_kernel(kind, indices, leftmost, max_steps, max_size)
+    deadline = time.perf_counter() + timeout
+    steps = 0
+    peak = kind.size
+    while True:
+        kind, indices, done, status, p = comp.normalize_kernel(kind, indices, leftmost, min(check_steps, max_steps-steps), max_size)
+        steps += done
+        peak = max(peak, p)
+        if status != STEP_LIMIT or steps == max_steps:
+            return kind, indices, steps, status, peak
+        if time.perf_counter() > deadline:
+            return kind, indices, steps, TIMEOUT, peak
+
+# reduce l until it reaches a normal form, following the normal order (strategy='normal') or the applicative order
+# (strategy='applicative'), with a budget of max_steps steps, max_size nodes and timeout seconds. The whole loop runs
+# in compiled code, on the kinds and De Bruijn indices of the term, and the kernels are only computed once for the result.
+# with a cache (see hashing.NormalFormCache), terms normalized before are not reduced again.
+# returns the reduced term, the number of steps performed and the outcome
+def normalize(l:Lambda, strategy='normal', max_steps=1000, max_size=None, cache=None, timeout=None):
+    if strategy not in ('normal', 'applicative'):
+        raise ValueError("strategy should be 'normal' or 'applicative'")
+    if max_size is None:
+        max_size = np.iinfo(np.int64).max
+    if cache is not None:
+        hit = cache.get(l, strategy)
+        # the cached reduction is only valid if it fits in the budget
+        if hit is not None and hit[1] <= max_steps and hit[2] <= max_size:
+            ins.count('reduction.cache_hits')
+            return hit[0], hit[1], NORMALIZED
+    t = ins.start()
+    kind, indices, steps, status, peak = normalize_arrays(l.node_kind(), l.de_bruijn_indices.astype(np.int64), strategy == 'normal', max_steps, max_size, timeout)
+    result = Lambda.from_kind(kind, indices)
+    if t is not None:
+        ins.stop('reduction.normalize', t)
+        ins.observe('reduction.normalize.steps', steps)
+        ins.observe('reduction.normalize.peak', peak)
+        ins.count(f'reduction.outcome.{OUTCOME_NAMES[int(status)]}')
+    if cache is not None and status == NORMALIZED:
+        cache.put(l, strategy, result, steps, peak)
+    return result, steps, status
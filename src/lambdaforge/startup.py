@@ -0,0 +1,57 @@
+import time
+import numpy as np
+import lambdaforge.production as pr
+import lambdaforge.parsing as ps
+import lambdaforge.reduction as rd
+import lambdaforge.hashing as hs
+from .lambda_term import Lambda
+from .batch import LambdaBatch
+from .forge import Forge, Geometric, TruncatedGeometric, UniformBinder
+from .dag import LambdaDAG
+from .trace import trace_reduction
+
+# compile the kernels of the usual operations ahead of time, for the supported dtypes: int8 kinds, int32 and int64
+# kernels, and int8 to int64 De Bruijn indices. The kernels are cached on disk, so that only the first warmup in an
+# environment compiles them, and the following processes (batch workers...) only load them.
+# numba compiles a kernel again for each dtype and for read-only or writable arrays, so the terms of the warmup are
+# built as the terms of the library are, through from_kind and the Forge, and only widened to the other dtypes.
+# with parallel=True, the parallel versions of the segmented kernels are compiled too.
+# returns the time spent, in seconds
+def warmup(parallel=False):
+    t0 = time.perf_counter()
+    # (λ 1) (λ 1), with a redex at the root
+    kind = np.array([1, 0, -1, 0, -1], dtype=np.int8)
+    offsets = np.array([0, kind.size, 2 * kind.size], dtype=np.int64)
+    kinds = np.concatenate((kind, kind))
+    # De Bruijn indices narrowed to int8, int16, int32 and int64
+    for index in (1, 2**8, 2**16, 2**32):
+        small = Lambda.from_kind(kind, np.full(kind.size, index))
+        batch = LambdaBatch.from_kind(kinds, np.full(kinds.size, index), offsets)
+        for dtype in (np.int32, np.int64):
+            l = Lambda(small.size, small.abstraction_kernel.astype(dtype), small.application_kernel.astype(dtype),
+                       small.variable_kernel.astype(dtype), small.de_bruijn_indices)
+            l.height(), l.bindings(), l.subterm_hashes(), l.layout()
+            rd.reduce_at(l, 0)
+            rd.normalize(l), rd.normalize(l, 'applicative')
+            pr.polish_de_bruijn(l), pr.parenthesis_de_bruijn(l)
+            b''.join(pr.iter_polish_de_bruijn(l)), b''.join(pr.iter_parenthesis_de_bruijn(l))
+            b = LambdaBatch(batch.offsets, batch.abstraction_kernel.astype(dtype), batch.application_kernel.astype(dtype),
+                            batch.variable_kernel.astype(dtype), batch.de_bruijn_indices)
+            b.height(), b.backward_integral(np.ones(kinds.size, dtype=dtype)), b.statistics()
+            if parallel:
+                b.height(parallel=True), b.backward_integral(np.ones(kinds.size, dtype=dtype), parallel=True), b.statistics(parallel=True)
+            hs.deduplicate(b)
+        if parallel:
+            LambdaBatch.from_kind(kinds, np.full(kinds.size, index), offsets, parallel=True)
+    # sampling with the different samplers, parsing, sharing and traces, on the terms they produce
+    for exact_size in (False, True):
+        for sampler in (Geometric(), TruncatedGeometric(0.3, 1), UniformBinder(1)):
+            f = Forge(5, 20, exact_size=exact_size, seed=0)
+            f.de_bruijn_sampler = sampler
+            l, b = f.craft(), f.craft_many(2)
+            l.bindings(), l.layout(), rd.normalize(l, max_steps=10), b.statistics()
+    ps.parse_de_bruijn_batch('@ λ 1 λ 1\nλ 1\n')
+    d = LambdaDAG()
+    d.to_lambda(d.normalize(d.from_lambda(Lambda.from_kind(kind, np.ones(kind.size))))[0])
+    trace_reduction(Lambda.from_kind(kind, np.ones(kind.size))).term(1)
+    return time.perf_counter() - t0
@@ -0,0 +1,95 @@
+import struct
+import numpy as np
+from .lambda_term import Lambda
+from .batch import LambdaBatch
+
+# binary container for a Lambda or a LambdaBatch. All the values are little-endian.
+#
+# header (128 bytes):
+#   magic      8 bytes   b'LMBDFRG\0'
+#   version    uint16    1
+#   flags      uint16    bit 0: the file holds a batch, bit 1: the kernels are stored (otherwise the kinds are)
+#   count      uint64    number of terms (1 for a Lambda)
+#   nodes      uint64    total number of nodes
+#   5 entries, one per array, made of the numpy type string of the array (4 bytes, like b'<i4') and the position
+#   of its first byte in the file (uint64). Absent arrays have an empty type and position 0.
+#   the rest of the header is filled with zeros
+#
+# arrays, each one starting at a multiple of 64 bytes:
+#   offsets            int64, count+1 values: the term j occupies the nodes offsets[j]:offsets[j+1]
+#   abstraction_kernel relative to the first node of each term, or the kinds (int8) when the kernels are not stored
+#   application_kernel (absent when the kernels are not stored)
+#   variable_kernel    (absent when the kernels are not stored)
+#   de_bruijn_indices
+MAGIC = b'LMBDFRG\0'
+VERSION = 1
+HEADER = struct.Struct('<8sHHQQ' + '4sQ' * 5)
+HEADER_SIZE = 128
+ALIGNMENT = 64
+BATCH = 1
+KERNELS = 2
+
+# write a Lambda or a LambdaBatch to path. With kernels=False, only the kinds and the De Bruijn indices are written,
+# and the kernels are computed again by load
+def save(path, term, kernels: bool = True):
+    batch = isinstance(term, LambdaBatch)
+    offsets = term.offsets if batch else np.array([0, term.size], dtype=np.int64)
+    if kernels:
+        arrays = [offsets, term.abstraction_kernel, term.application_kernel, term.variable_kernel, term.de_bruijn_indices]
+    else:
+        arrays = [offsets, term.node_kind(), None, None, term.de_bruijn_indices]
+    # store every array in little-endian order
+    arrays = [None if a is None else np.asarray(a).astype(np.asarray(a).dtype.newbyteorder('<'), copy=False) for a in arrays]
+    entries = []
+    position = HEADER_SIZE
+    for a in arrays:
+        if a is None:
+            entries += [b'', 0]
+            continue
+        entries += [a.dtype.str.encode(), position]
+        position += -(-a.nbytes // ALIGNMENT) * ALIGNMENT
+    flags = (BATCH if batch else 0) | (KERNELS if kernels else 0)
+    header = HEADER.pack(MAGIC, VERSION, flags, offsets.size - 1, int(offsets[-1]), *entries)
+    with open(path, 'wb') as f:
+        f.write(header.ljust(HEADER_SIZE, b'\0'))
+        for a in arrays:
+            if a is None: continue
+            a.tofile(f)
+            f.write(b'\0' * (-a.nbytes % ALIGNMENT))
+
+# read the header of a file written by save
+def read_header(path):
+    with open(path, 'rb') as f:
+        data = f.read(HEADER_SIZE)
+    if len(data) < HEADER.size:
+        raise ValueError(f'{path} is not a lambdaforge file, or is truncated')
+    values = HEADER.unpack(data[:HEADER.size])
+    magic, version, flags, count, nodes = values[:5]
+    if magic != MAGIC:
+        raise ValueError(f'{path} is not a lambdaforge file')
+    if version != VERSION:
+        raise ValueError(f'unsupported lambdaforge file version {version}')
+    entries = [(values[i].rstrip(b'\0').decode(), values[i+1]) for i in range(5, len(values), 2)]
+    return flags, count, nodes, entries
+
+# read a Lambda or a LambdaBatch from path. With mmap=True, the arrays are memory-mapped and only read from disk
+# when they are used, so that a term larger than the memory can be opened at once and explored with subterm.
+# files written with kernels=False are read entirely, to compute the kernels
+def load(path, mmap: bool = True):
+    flags, count, nodes, entries = read_header(path)
+    def read(i, size):
+        dtype, position = entries[i]
+        if mmap and size > 0:
+            return np.memmap(path, dtype=np.dtype(dtype), mode='r', offset=position, shape=(size,))
+        return np.fromfile(path, dtype=np.dtype(dtype), count=size, offset=position)
+    offsets = read(0, count + 1)
+    de_bruijn_indices = read(4, nodes)
+    if flags & KERNELS:
+        arrays = [read(i, nodes) for i in (1, 2, 3)]
+        if flags & BATCH:
+            return LambdaBatch(offsets, *arrays, de_bruijn_indices)
+        return Lambda(nodes, *arrays, de_bruijn_indices)
+    kind = read(1, nodes)
+    if flags & BATCH:
+        return LambdaBatch.from_kind(kind, de_bruijn_indices, offsets)
+    return Lambda.from_kind(kind, de_bruijn_indices)
@@ -0,0 +1,63 @@
+import numpy as np
+import lambdaforge.computation as comp
+from dataclasses import dataclass
+from .lambda_term import Lambda
+
+# a reduction sequence stored as deltas: the start term, and for each step the position of the reduced redex, the
+# number of nodes it occupied (the application, the abstraction, its body and the argument) and the number of nodes
+# of its reduct. The term after any step is rebuilt on demand by replaying the steps from the start term, and the
+# statistics of the sequence are computed from the deltas alone
+@dataclass
+class ReductionTrace:
+    start:Lambda
+    positions:np.array(np.int64) # the position of the redex reduced at each step, as given to reduction.reduce_at
+    removed:np.array(np.int64)   # the size of the redex
+    inserted:np.array(np.int64)  # the size of its reduct
+    status:int                   # the outcome of the reduction, as in reduction.normalize
+
+    # number of steps
+    def __len__(self):
+        return self.positions.size
+
+    # the size of the term before the first step and after each step
+    def sizes(self):
+        return np.concatenate(([self.start.size], self.start.size + np.cumsum(self.inserted - self.removed)))
+
+    # the position of the redex reduced at each step, relative to the size of the term at this step
+    def relative_positions(self):
+        return self.positions / self.sizes()[:-1]
+
+    # the largest size reached
+    def peak(self):
+        return np.max(self.sizes())
+
+    # the term after the given number of steps (0 for the start term, len(trace) for the final term)
+    def term(self, step:int):
+        if not 0 <= step <= len(self): raise IndexError('step out of range')
+        if step == 0: return self.start
+        kind, indices, _, _, _, _, _, _ = comp.reduce_loop(self.start.node_kind(), self.start.de_bruijn_indices.astype(np.int64), True,
+                                                           step, np.iinfo(np.int64).max, self.positions[:step], False)
+        return Lambda.from_kind(kind, indices)
+
+    # the terms after each of the given steps, replaying the sequence once
+    def terms(self, steps):
+        terms = {}
+        l, done = self.start, 0
+        for step in sorted(set(steps)):
+            if not 0 <= step <= len(self): raise IndexError('step out of range')
+            if step > done:
+                kind, indices, _, _, _, _, _, _ = comp.reduce_loop(l.node_kind(), l.de_bruijn_indices.astype(np.int64), True,
+                                                                   step-done, np.iinfo(np.int64).max, self.positions[done:step], False)
+                l, done = Lambda.from_kind(kind, indices), step
+            terms[step] = l
+        return [terms[step] for step in steps]
+
+# reduce l as reduction.normalize does, and record the reduction sequence
+def trace_reduction(l:Lambda, strategy='normal', max_steps=1000, max_size=None) -> ReductionTrace:
+    if strategy not in ('normal', 'applicative'):
+        raise ValueError("strategy should be 'normal' or 'applicative'")
+    if max_size is None:
+        max_size = np.iinfo(np.int64).max
+    _, _, _, status, _, positions, removed, inserted = comp.reduce_loop(l.node_kind(), l.de_bruijn_indices.astype(np.int64), strategy == 'normal',
+                                                                       max_steps, max_size, np.zeros(0, dtype=np.int64), True)
+    return ReductionTrace(l, positions, removed, inserted, status)
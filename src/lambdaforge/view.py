@@ -0,0 +1,150 @@
+import numpy as np
+import lambdaforge.computation as comp
+from dataclasses import dataclass
+from .lambda_term import Lambda
+
+# views of lambda terms that are not stored contiguously. A subterm is a slice of the term it comes from, and
+# a replacement is a splice of a new term into an old one: both are created in constant time, without copying
+# any array, and the kernels are translated when they are read. Views can be nested, and a replacement compacts
+# its result into a contiguous Lambda when the nesting gets deeper than max_depth
+
+FORWARD = ('abstraction_kernel', 'application_kernel') # kernels pointing to an ancestor, -1 if there is none
+MAX_DEPTH = 32
+
+class LambdaView:
+    # a view of the whole Lambda l
+    @staticmethod
+    def of(l):
+        return l if isinstance(l, LambdaView) else TermView(l.size, 0, l)
+
+    # the values of an array of the term (abstraction_kernel, application_kernel, variable_kernel or de_bruijn_indices)
+    # for the nodes start:stop, as int64
+    def read(self, name, start=0, stop=None):
+        if stop is None: stop = self.size
+        return self.read_range(name, start, max(start, stop))
+
+    # kind of each node (variable:-1,abstraction:0,application:1), as in Lambda.node_kind
+    def node_kind(self):
+        dq = np.sign(np.diff(self.read('application_kernel'), append=0)).astype(np.int8)
+        dq[self.size-1] = -1
+        return dq
+
+    # the view of the subterm rooted at a given index. The slice is taken in the deepest view holding the whole subterm
+    def subterm(self, index:int):
+        index = int(index)
+        var = int(self.read('variable_kernel', index, index+1)[0])
+        return self.slice(index, var+1-index)
+
+    def slice(self, start, size):
+        return SliceView(size, self.depth+1, self, start)
+
+    # the view of the term where the subterm at index is replaced by another term (a Lambda or a view)
+    def replace(self, index:int, other, max_depth:int = MAX_DEPTH):
+        index = int(index)
+        other = LambdaView.of(other)
+        var = int(self.read('variable_kernel', index, index+1)[0])
+        view = SpliceView(self.size + other.size - (var+1-index), 1 + max(self.depth, other.depth), self, index, var, other)
+        if view.depth > max_depth:
+            return view.compact()
+        return view
+
+    # the term as a contiguous Lambda
+    def to_lambda(self):
+        dtype = comp.index_dtype(self.size)
+        return Lambda(self.size,
+                      self.read('abstraction_kernel').astype(dtype),
+                      self.read('application_kernel').astype(dtype),
+                      self.read('variable_kernel').astype(dtype),
+                      comp.narrow_de_bruijn(self.read('de_bruijn_indices')))
+
+    # a view of a copy of the term, without nesting
+    def compact(self):
+        return LambdaView.of(self.to_lambda())
+
+# a whole Lambda
+@dataclass
+class TermView(LambdaView):
+    size:int
+    depth:int
+    term:Lambda
+
+    def read_range(self, name, start, stop):
+        return getattr(self.term, name)[start:stop].astype(np.int64)
+
+    def slice(self, start, size):
+        return SliceView(size, 1, self, start)
+
+# the nodes start:start+size of a view, holding a subterm. Ancestors outside of the subterm are read as -1
+@dataclass
+class SliceView(LambdaView):
+    size:int
+    depth:int
+    source:LambdaView
+    start:int
+
+    def read_range(self, name, start, stop):
+        a = self.source.read_range(name, start+self.start, stop+self.start)
+        if name in FORWARD:
+            a -= self.start
+            a[a < 0] = -1
+        elif name == 'variable_kernel':
+            a -= self.start
+        return a
+
+    # slices of slices are slices of the source
+    def slice(self, start, size):
+        return self.source.slice(self.start+start, size)
+
+# the view outer where the subterm at nodes index:var+1 is replaced by inner
+@dataclass
+class SpliceView(LambdaView):
+    size:int
+    depth:int
+    outer:LambdaView
+    index:int
+    var:int
+    inner:LambdaView
+
+    def read_range(self, name, start, stop):
+        index, var = self.index, self.var
+        end = index + self.inner.size
+        shift = end - (var+1)
+        parts = []
+        # nodes before the replaced subterm: the subtrees containing it end shift nodes further
+        if start < index:
+            a = self.outer.read_range(name, start, min(stop, index))
+            if name == 'variable_kernel':
+                a[a >= var] += shift
+            parts.append(a)
+        # nodes of the new term: the ancestors outside of it are those of the replaced subterm
+        if start < end and stop > index:
+            a = self.inner.read_range(name, max(start, index)-index, min(stop, end)-index)
+            if name in FORWARD:
+                outside = a < 0
+                a += index
+                a[outside] = self.outer.read_range(name, index, index+1)[0]
+            elif name == 'variable_kernel':
+                a += index
+            parts.append(a)
+        # nodes after the replaced subterm
+        if stop > end:
+            a = self.outer.read_range(name, max(start, end)-shift, stop-shift)
+            if name in FORWARD:
+                a[a > var] += shift
+            elif name == 'variable_kernel':
+                a += shift
+            parts.append(a)
+        if len(parts) == 1:
+            return parts[0]
+        return np.concatenate(parts) if parts else np.zeros(0, dtype=np.int64)
+
+    # a subterm lying on one side of the splice is sliced from that side
+    def slice(self, start, size):
+        end = self.index + self.inner.size
+        if start + size <= self.index:
+            return self.outer.slice(start, size)
+        if start >= self.index and start + size <= end:
+            return self.inner.slice(start - self.index, size)
+        if start >= end:
+            return self.outer.slice(start - end + self.var + 1, size)
+        return SliceView(size, self.depth+1, self, start)
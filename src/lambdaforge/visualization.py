@@ -1,7 +1,12 @@
+import zlib
+import struct
 import numpy as np
-import matplotlib.collections as plt_collections
+import lambdaforge.computation as comp
 from lambdaforge.lambda_term import Lambda
 
+# matplotlib is only imported by the functions drawing with it, so that the raster renderer and the rest of
+# lambdaforge do not need it
+
 # draw the nodes of the lambda term
 def draw_nodes(l:Lambda, ax, positions_x, positions_y, abs_color='yellow', app_color='blue', var_color='red', size=5):
     var = l.variables()
@@ -21,6 +26,7 @@ def draw_edges(l:Lambda, ax, positions_x, positions_y, color='blue', width=1):
     edges[:, 1, 0] = positions_x
     edges[:, 1, 1] = positions_y
 
+    import matplotlib.collections as plt_collections
     lc = plt_collections.LineCollection(edges[1:, :, :], zorder=1, colors=color, linewidth=width)
     ax.add_collection(lc)
     
@@ -33,6 +39,7 @@ def draw_bindings(l:Lambda,ax,positions_x,positions_y,color = 'red',alpha=0.2,wi
     edges[:,0,1] = positions_y[bindings[bv]]
     edges[:,1,0] = positions_x[bv]
     edges[:,1,1] = positions_y[bv]
+    import matplotlib.collections as plt_collections
     lc = plt_collections.LineCollection(edges[:,:,:],zorder=0, colors=color,alpha=alpha,linewidth = width)
     ax.add_collection(lc)
     
@@ -59,10 +66,106 @@ def draw(l:Lambda,
     fig.patch.set_facecolor('black')
     #fig.set_size_inches(10, 25)
     return fig, ax
-    
-    
-    
 
+# raster rendering, for terms too large for matplotlib: the nodes, the edges and the bindings are accumulated
+# in one density image per layer with compiled kernels, and the layers are added together with their color and
+# alpha, after a logarithmic (or linear) scaling of each density
 
+# colors are RGB tuples with values between 0 and 1, or strings '#rrggbb'
+def rgb(color):
+    if isinstance(color, str):
+        return tuple(int(color[i:i+2], 16) / 255 for i in (1, 3, 5))
+    return tuple(color)
 
-    
+# accumulate the nodes start:stop of l, the edges to their parents and the bindings of their variables into density
+# images of the given shape, in which the rectangle frame = (xmin, xmax, ymin, ymax) of the layout is drawn
+def rasterize_layers(l:Lambda, positions_x, positions_y, shape, frame, start=0, stop=None, nodes=True, edges=True, bindings=True):
+    if stop is None: stop = l.size
+    xmin, xmax, ymin, ymax = frame
+    height, width = shape
+    # layout coordinates to pixels, the root being at the top
+    px = (positions_x[start:stop] - xmin) * ((width-1) / max(xmax - xmin, 1e-12))
+    py = (positions_y[start:stop] - ymin) * ((height-1) / max(ymax - ymin, 1e-12))
+    layers = {}
+    if nodes:
+        kind = l.node_kind()[start:stop]
+        for name, k in (('abstractions', 0), ('applications', 1), ('variables', -1)):
+            layers[name] = np.zeros(shape, dtype=np.float32)
+            comp.rasterize_points(layers[name], px[kind == k], py[kind == k])
+    if edges:
+        layers['edges'] = np.zeros(shape, dtype=np.float32)
+        parents = l.parents()[start:stop] - start
+        child = np.flatnonzero(parents >= 0)
+        comp.rasterize_segments(layers['edges'], px[parents[child]], py[parents[child]], px[child], py[child])
+    if bindings:
+        layers['bindings'] = np.zeros(shape, dtype=np.float32)
+        b = l.bindings()[start:stop] - start
+        bv = np.flatnonzero(l.bounded_var()[start:stop] & (b >= 0))
+        comp.rasterize_segments(layers['bindings'], px[b[bv]], py[b[bv]], px[bv], py[bv])
+    return layers
+
+# render l as an RGB image (an array of uint8 of shape (height, width, 3)).
+# root selects the subterm to render, which is framed to fit the image, and region = (xmin, xmax, ymin, ymax) zooms
+# on a rectangle of the layout: in both cases, only the range of nodes that can appear in the image is rasterized
+def rasterize(l:Lambda,
+              width=1024,
+              height=1024,
+              layout='default',
+              root=0,
+              region=None,
+              scale='log',
+              abs_color=(1, 1, 0),
+              app_color=(0, 0, 1),
+              var_color=(1, 0, 0),
+              node_alpha=1.0,
+              edge_color=(0.68, 0.85, 0.9),
+              edge_alpha=0.6,
+              binding_color=(1, 0, 0),
+              binding_alpha=0.2,
+              nodes=True, edges=True, bindings=True):
+    if(layout=='default'):
+        x_pos,y_pos = l.layout()
+    else:
+        x_pos,y_pos = layout
+    # the subterm at root occupies the nodes root:variable_kernel[root]+1
+    start, stop = int(root), int(l.variable_kernel[root]) + 1
+    if region is None:
+        region = (np.min(x_pos[start:stop]), np.max(x_pos[start:stop]), np.min(y_pos[start:stop]), np.max(y_pos[start:stop]))
+    else:
+        # the nodes between the first and the last node of the region
+        xmin, xmax, ymin, ymax = region
+        inside = np.flatnonzero((x_pos[start:stop] >= xmin) & (x_pos[start:stop] <= xmax) & (y_pos[start:stop] >= ymin) & (y_pos[start:stop] <= ymax))
+        if inside.size > 0:
+            start, stop = start + inside[0], start + inside[-1] + 1
+    layers = rasterize_layers(l, x_pos, y_pos, (height, width), region, start, stop, nodes, edges, bindings)
+    colors = {'abstractions': (abs_color, node_alpha), 'applications': (app_color, node_alpha), 'variables': (var_color, node_alpha),
+              'edges': (edge_color, edge_alpha), 'bindings': (binding_color, binding_alpha)}
+    image = np.zeros((height, width, 3), dtype=np.float32)
+    for name, density in layers.items():
+        if scale == 'log':
+            density = np.log1p(density)
+        peak = np.max(density)
+        if peak == 0: continue
+        color, alpha = colors[name]
+        image += (alpha / peak) * density[:, :, None] * np.array(rgb(color), dtype=np.float32)
+    return (np.clip(image, 0, 1) * 255).astype(np.uint8)
+
+# write an RGB (or gray) image of uint8 to a PNG file
+def write_png(path, image):
+    image = np.ascontiguousarray(image, dtype=np.uint8)
+    height, width = image.shape[:2]
+    color_type = 2 if image.ndim == 3 else 0
+    # each row starts with its filter type (0: none)
+    raw = np.zeros((height, 1 + image[0].size), dtype=np.uint8)
+    raw[:, 1:] = image.reshape(height, -1)
+    def chunk(kind, data):
+        return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data) & 0xffffffff)
+    with open(path, 'wb') as f:
+        f.write(b'\x89PNG\r\n\x1a\n')
+        f.write(chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, color_type, 0, 0, 0)))
+        f.write(chunk(b'IDAT', zlib.compress(raw.tobytes(), 6)))
+        f.write(chunk(b'IEND', b''))
+
+# render l and write it to a PNG file
+def render_png(l:Lambda, path, **options):
+    write_png(path, rasterize(l, **options))